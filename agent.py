@@ -1,11 +1,19 @@
 from itertools import count
+import heapq
 import numpy as np
 import collections
-import copy
 
 from systemd.journal import send
 
-from grid2d import Grid2D, EMPTY, GLOBAL_OBSTACLE, LOCAL_OBSTACLE
+from grid2d import Grid2D, EMPTY, GLOBAL_OBSTACLE, LOCAL_OBSTACLE, neighbour_table
+from chunked_grid import new_grid
+from perception import window_cells
+from belief_store import BeliefStore
+from agent_registry import NO_COORD, ACTIVE, AT_GOAL, WAITING
+from history import History, FULL, DEFAULT_HISTORY_SIZE, plan_snapshot
+from static_layer import OverlayGrid2D, UNREACHABLE
+from incremental_planner import IncrementalPlanner
+from safe_intervals import ConcededPlans, find_path_safe_intervals
 from edict import Broadcaster
 from utils import *
 from interactive_argument import InteractiveArgument
@@ -15,20 +23,37 @@ from locution import *
 
 class Agent:
     EXPLAINABLE = True
+    HISTORY_POLICY = FULL  # Retention of world models and plans per time step (see history.HISTORY_POLICIES).
+    HISTORY_SIZE = DEFAULT_HISTORY_SIZE  # Time steps kept by the RING policy.
+    SAFE_INTERVALS = True  # Conceding agents plan with safe_intervals.find_path_safe_intervals.
 
     def __init__(self, agent_id, grid_dimensions, simulator):
-        self.__goal = None
         self.__plan = []
-        self.__optimal_plan = []
-        self.__known_cells = {}
+        self.__optimal_plan = (None, None)  # (Planning key, plan) of the last optimal plan. See optimal_plan.
+        self.__belief_version = 0  # Bumped whenever the world model changes.
+        self.__plan_dirty = False  # Beliefs changed in a way that may change the plan. See update_plan.
+        self.__plan_key = None  # Planning inputs of the current plan. See __planning_key.
+        self.__record_plan = False  # The next plan is recorded in the plan history.
+        self.__constraints_version = 0  # Bumped whenever the estimated plans of other agents change.
+        self.__goal_distances = None  # IncrementalPlanner with the distances to the goal. See distances_to.
+        self.__last_search_expansions = 0
+        self.__search_expansions = 0  # States expanded by every find_path_3D_search call.
+        self.__beliefs = BeliefStore(*grid_dimensions)
+        self.__reported_cells = set()  # Cells written by locutions since the last perception.
+        self.__pending_events = True  # Something besides its surroundings changed since the last perception.
+        self.__static_layer = None  # Shared global obstacles (see static_layer.StaticLayer).
         self.__agent_id = agent_id
-        self.__visibility_radius = 2  # np.random.randint(4, 5)  # TODO: Change this.
-        self.__current_pos = None
+        # Position, goal, status, visibility radius and culture properties live in the simulator's registry.
+        self.__registry = simulator.registry()
+        if self.__registry.register(agent_id, visibility_radius=2) is None:  # np.random.randint(4, 5)  # TODO: Change this.
+            # Two agents sharing a row would overwrite each other's position, goal and status.
+            raise ValueError("Agent::__init__: Agent {} is already registered.".format(agent_id))
         self.__current_time_step = 0
         self.__latest_world_model = None
-        self.__previous_world_models = {}
-        self.__previous_plans = {}
-        self.__previous_optimal_plans = {}
+        self.__previous_world_models = History(Agent.HISTORY_POLICY, Agent.HISTORY_SIZE,
+                                               diff=Grid2D.delta_to, patch=Grid2D.with_changes)
+        self.__previous_plans = History(Agent.HISTORY_POLICY, Agent.HISTORY_SIZE, snapshot=plan_snapshot)
+        self.__previous_optimal_plans = History(Agent.HISTORY_POLICY, Agent.HISTORY_SIZE, snapshot=plan_snapshot)
         self.__grid_width, self.__grid_height = grid_dimensions
         self.__simulator = simulator
         self.__other_agents_waypoints = {}
@@ -51,10 +76,10 @@ class Agent:
         Broadcaster().subscribe("/time_penalty", self.count_time_penalty)
 
     def __getitem__(self, item):
-        return self.__dict__.get(item, None)
+        return self.__registry.property(self.__agent_id, item)
 
     def __setitem__(self, key, value):
-        self.__dict__[key] = value
+        self.__registry.set_property(self.__agent_id, key, value)
 
     def count_time_penalty(self):
         self.time_penalty += 1
@@ -67,9 +92,10 @@ class Agent:
 
     def set_human_control(self, control):
         self.__human_controlled = control
+        self.__pending_events = True
         if self.__human_controlled is True:
-            if self.__current_pos is not None:
-                self.__plan = [(self.__current_pos, self.__current_time_step)]
+            if self.current_pos() is not None:
+                self.__set_plan([(self.current_pos(), self.__current_time_step)])
             Broadcaster().subscribe("/direction_chosen", self.set_direction)
             Broadcaster().subscribe("/new_time_step", self.change_score)
             Broadcaster().subscribe("/human_collision", self.score_collision)
@@ -88,9 +114,10 @@ class Agent:
     def set_direction(self, direction):
         if self.__human_controlled is False:
             return
-        if self.__current_pos is not None:
-            self.__plan[0] = (self.__current_pos, self.__current_time_step)
-        x, y = self.__current_pos
+        self.update_plan()
+        if self.current_pos() is not None:
+            self.__plan[0] = (self.current_pos(), self.__current_time_step)
+        x, y = self.current_pos()
         if direction == MoveDirection.UP and y > 0:
             self.__plan[1] = ((x, y - 1), self.__current_time_step+1)
         elif direction == MoveDirection.DOWN and y < self.__grid_height :
@@ -102,8 +129,8 @@ class Agent:
         else:
             self.__plan[1] = ((x, y), self.__current_time_step+1)
         self.__current_direction = direction
-        self.__previous_plans[self.__current_time_step] = copy.deepcopy(self.__plan)
-        self.__previous_optimal_plans[self.__current_time_step] = copy.deepcopy(self.__optimal_plan)
+        self.__simulator.plan_changed(self.__agent_id, self.__plan)
+        self.__previous_plans.record(self.__current_time_step, self.__plan)
         Broadcaster().publish("/score_changed", self.score)
 
     def culture_properties(self):
@@ -114,7 +141,7 @@ class Agent:
     def get_properties_as_text(self):
         text = ""
         for property in self.culture_properties():
-            value = self.__dict__.get(property, None)
+            value = self[property]
             text += str(property) + ": " + str(value) + "\n"
         return text
 
@@ -124,52 +151,124 @@ class Agent:
             print("Agent::set_culture: Culture {} has no properties.".format(culture.name))
             return
         for property, default_value in self.culture_properties().items():
-            self.__setattr__(property, default_value)
+            self[property] = default_value
 
     def assign_property_value(self, property, value):
-        if hasattr(self, property) is False:
+        if not self.__registry.has_property(self.__agent_id, property):
             print("Agent::assign_property_value: Property {} not found within agent.".format(property))
             return
-        self.__setattr__(property, value)
+        self[property] = value
 
     def agent_id(self):
         return self.__agent_id
 
     def visibility_radius(self):
-        return self.__visibility_radius
+        return int(self.__registry.visibility_radii[self.__registry.row(self.__agent_id)])
 
     def assign_goal(self, goal):
         """
         Assigns a goal to the agent.
         :param goal: x,y tuple representing goal coordinates.
         """
-        self.__goal = goal
+        self.__registry.set_goal(self.__agent_id, goal)
+        self.__pending_events = True
+        self.__update_status()
 
     def set_current_pos(self, current_pos):
         """
         Informs the agent what is its current position.
         :param current_pos: x,y tuple representing current position.
         """
-        self.__current_pos = current_pos
+        self.__registry.set_position(self.__agent_id, current_pos)
+        self.__update_status()
+
+    def __update_status(self):
+        row = self.__registry.row(self.__agent_id)
+        at_goal = self.__registry.goals[row][0] != NO_COORD and \
+            (self.__registry.positions[row] == self.__registry.goals[row]).all()
+        if at_goal:
+            status = AT_GOAL
+        elif self.__plan is None and not self.__plan_dirty and len(self.__conceding_to_agents) == 0 and \
+                not self.__human_controlled:
+            # Replanning on the same beliefs would fail again.
+            status = WAITING
+        else:
+            status = ACTIVE
+        self.__registry.status[row] = status
+
+    def status(self):
+        """
+        :returns One of agent_registry.AGENT_STATUSES.
+        """
+        return int(self.__registry.status[self.__registry.row(self.__agent_id)])
+
+    def has_pending_events(self):
+        """
+        :returns True if the agent received a goal, a locution or a change of control since its last perception.
+        """
+        return self.__pending_events
 
     def rebuild_partial_world_model(self):
         """
         Rebuilds a 2D grid representing the current knowledge/beliefs of the agent.
         :return: False if information is insufficient. True if successful.
         """
-        if self.__current_pos is None:
+        if self.current_pos() is None:
             print("Agent::build_partial_world_model: Current position not defined.")
             return False
-        self.__latest_world_model = Grid2D(self.__grid_width, self.__grid_height)
-        for coord, cell in self.__known_cells.items():
-            if Grid2D.is_obstacle(cell):
-                self.__latest_world_model.add_obstacle(coord, cell)
-            elif cell != EMPTY:
-                self.__latest_world_model.add_agent(cell, coord)
+        if self.__static_layer is None:
+            self.__latest_world_model = new_grid(self.__grid_width, self.__grid_height)
+        else:
+            self.__latest_world_model = OverlayGrid2D(self.__static_layer)
+        self.__beliefs.materialise(self.__latest_world_model)
         # print("\nVisible world for agent {0} ({3}) (radius {2}): \n{1}.".format(
         #     self.__agent_id, self.__latest_world_model.cells.transpose(), self.__visibility_radius, self.__current_pos))
         return True
 
+    def perceive(self, origin, window, time_step, static_layer=None, changed=None):
+        """
+        Receives the cells within visibility range as a window of the map at the current time step.
+        :param origin: (x,y) coordinate of window[0][0].
+        :param window: Numpy 2D array of cell values. Cells outside the map are perception.OUT_OF_BOUNDS.
+        :param time_step: Current time step.
+        :param static_layer: StaticLayer with the global obstacles of the map, shared by all agents.
+        The world model is rebuilt on top of it whenever a different layer is received.
+        :param changed: Numpy 2D boolean array, True for the cells of the window that changed since the previous
+        perception (see perception.window_changes). If None, the whole window is merged.
+        """
+        if changed is not None and len(self.__reported_cells) > 0:
+            # Cells reported by others may disagree with what is in sight even if the window did not change.
+            changed = changed.copy()
+            for x, y in self.__reported_cells:
+                i, j = x - origin[0], y - origin[1]
+                if 0 <= i < window.shape[0] and 0 <= j < window.shape[1]:
+                    changed[i, j] = True
+        xs, ys, values = window_cells(origin, window, changed)
+        if static_layer is not None and static_layer is not self.__static_layer:
+            self.__static_layer = static_layer
+            self.__latest_world_model = None
+        self.__update_beliefs(self.__beliefs.merge(xs, ys, values, time_step), time_step)
+        self.__reported_cells = set()
+        self.__pending_events = False
+
+    def idle(self, time_step):
+        """
+        Lets time pass for an agent whose beliefs would not change (see Simulator.update_agents).
+        Equivalent to a perception with no changes: history is kept, but nothing is replanned.
+        Agents that are not at their goal must be WAITING, as replanning would fail again.
+        :param time_step: Current time step.
+        """
+        if time_step > self.__current_time_step:
+            self.update_plan()
+            self.clear_negotiation_status()
+        self.__current_time_step = time_step
+        if len(self.__previous_world_models) <= 1 or time_step not in self.__previous_world_models:
+            self.__previous_world_models.record(time_step, self.__latest_world_model)
+        if self.goal() is None or self.current_pos() == self.goal():
+            return
+        if len(self.__previous_plans) <= 1 or time_step not in self.__previous_plans:
+            self.__previous_plans.record(time_step, self.__plan)
+
     def update_world_knowledge(self, visible_cells, time_step, overwrite=False):
         """
         Receives information about visible cells at the current time step.
@@ -177,77 +276,198 @@ class Agent:
         :param visible_cells: dict {key=coord (x,y tuple), value=cell (int)}
         :param time_step: Current time step.
         """
+        changes = self.__beliefs.merge_cells(visible_cells, time_step)
+        self.__reported_cells.update(changes.keys())
+        self.__update_beliefs(changes, time_step, overwrite)
+
+    def __update_beliefs(self, changes, time_step, overwrite=False):
+        """
+        Brings the world model up to date with merged beliefs and replans.
+        :param changes: dict {key=coord (x,y tuple), value=cell (int)} with the beliefs that changed.
+        :param time_step: Current time step.
+        """
         if time_step > self.__current_time_step:
+            self.update_plan()  # A plan still pending belongs to the previous time step.
             self.clear_negotiation_status()
         self.__current_time_step = time_step
 
-        # Merging two dictionaries.
-        self.__known_cells = {**self.__known_cells, **visible_cells}
-
-        # This step is important to avoid repeated occurrences of agents.
-        agents_found = {}
-        for coord, cell in self.__known_cells.items():
-            if cell > 0: # If is agent
-                if cell in agents_found: # Conflict!
-                    if visible_cells.get(coord, None) == cell: # If seen recently
-                        self.__known_cells[agents_found[cell]] = EMPTY
-                    else:
-                        self.__known_cells[coord] = EMPTY
-                agents_found[cell] = coord
-        self.rebuild_partial_world_model()
+        if self.__latest_world_model is None:
+            self.rebuild_partial_world_model()
+            self.__plan_key = None
+            self.__goal_distances = None
+            self.__belief_version += 1
+        elif len(changes) > 0:
+            affects_plan = self.__plan_key is not None and self.__changes_affect_plan(changes)
+            self.__latest_world_model.write_cells(changes)
+            self.__belief_version += 1
+            if self.__goal_distances is not None and self.__goal_distances.goal == self.goal():
+                redistanced = self.__goal_distances.update(changes)
+                affects_plan = affects_plan or not self.__planned_cells().isdisjoint(redistanced)
+            if affects_plan:
+                self.__plan_key = None
         # If it's still the first model (editing enabled) or a new one, then allow copying.
         if overwrite or (len(self.__previous_world_models) <= 1 or time_step not in self.__previous_world_models):
-            self.__previous_world_models[time_step] = copy.deepcopy(self.__latest_world_model)
-        if self.__goal is None:
+            self.__previous_world_models.record(time_step, self.__latest_world_model)
+        if self.goal() is None:
             return
-        if self.__current_pos != self.__goal:
-            self.__plan = self.find_path_3D_search((self.__current_pos, self.__current_time_step), self.__goal)
-            self.__optimal_plan = self.find_path_3D_search((self.__current_pos, self.__current_time_step), self.__goal, concede_to_agents=False)
-            if self.__human_controlled:
-                pass
-                # self.set_direction(self.__current_direction)
+        if self.current_pos() != self.goal():
+            # Humans replan on every update, as their plan is overwritten by set_direction.
+            if self.__human_controlled or self.__plan_key != self.__planning_key():
+                self.__plan_dirty = True
+                self.__update_status()
             if overwrite or (len(self.__previous_plans) <= 1 or time_step not in self.__previous_plans):
-                self.__previous_plans[time_step] = copy.deepcopy(self.__plan)
-                self.__previous_optimal_plans[time_step] = copy.deepcopy(self.__optimal_plan)
+                self.__record_plan = True
+            if not self.__plan_dirty:
+                self.__record_plans()
         # print("Path from {0} to {1}: {2}".format(self.__current_pos, self.__goal, self.__plan))
         # print("Turns from {0} to {1}: {2}".format(self.__current_pos, self.__goal, self.next_waypoints()))
 
+    def __planning_key(self):
+        """
+        Everything the plan depends on besides the world model.
+        """
+        return self.current_pos(), self.__current_time_step, self.goal(), \
+            frozenset(self.__conceding_to_agents), self.__constraints_version
+
+    def __changes_affect_plan(self, changes):
+        """
+        Checks whether writing changes into the world model may change the result of find_path_3D_search.
+        Searches only tell passable cells (>= 0) from obstacles, so agents moving around do not matter.
+        A cell that becomes passable may open a shorter path. A cell that becomes blocked only matters
+        if the plan goes through it (or, once written, if it changes the distance to the goal of a
+        planned cell), since every state of the plan can still be visited and other states are only
+        expanded later (see find_path_3D_search).
+        :param changes: dict {key=coord (x,y tuple), value=cell (int)} about to be written.
+        :returns True if the plan must be recomputed.
+        """
+        planned_cells = None
+        for coord, cell in changes.items():
+            passable = self.__latest_world_model.cell(coord) >= 0
+            if (cell >= 0) == passable:
+                continue
+            if not passable or len(self.__conceding_to_agents) > 0:
+                return True  # Safe interval searches keep the earliest arrival, not the first one.
+            if planned_cells is None:
+                planned_cells = self.__planned_cells()
+            if coord in planned_cells:
+                return True
+        return False
+
+    def __planned_cells(self):
+        return {step[POS] for step in self.__plan or ()}
+
+    def update_plan(self):
+        """
+        Replans if the plan is dirty. Updates within a time step are coalesced into a single replan,
+        which runs when the plan is first needed or right before moves are collected (see Simulator.simulate_step).
+        """
+        if not self.__plan_dirty:
+            return
+        self.__plan_dirty = False
+        self.__plan_key = self.__planning_key()
+        self.__set_plan(self.find_path_3D_search((self.current_pos(), self.__current_time_step), self.goal()))
+        self.__record_plans()
+
+    def __record_plans(self):
+        if self.__record_plan:
+            self.__record_plan = False
+            self.__previous_plans.record(self.__current_time_step, self.__plan)
+
+    def optimal_plan(self):
+        """
+        Plan the agent would follow if it did not concede to anyone. It is only displayed, so it is
+        computed on demand and memoised per time step and version of the beliefs.
+        :returns List of (coord, time step) tuples. None if the agent has no goal, is at its goal
+        or cannot reach it.
+        """
+        if self.goal() is None or self.current_pos() == self.goal():
+            return None
+        key = (self.current_pos(), self.__current_time_step, self.goal(), self.__belief_version)
+        if self.__optimal_plan[0] != key:
+            plan = self.find_path_3D_search((self.current_pos(), self.__current_time_step), self.goal(),
+                                            concede_to_agents=False)
+            self.__optimal_plan = (key, plan)
+            self.__previous_optimal_plans.record(self.__current_time_step, plan)
+        return self.__optimal_plan[1]
+
+    def distances_to(self, goal):
+        """
+        Lower bounds of the number of moves from every cell to goal. Distances to the agent's own goal are
+        exact for its beliefs, and kept up to date incrementally (see IncrementalPlanner). Other goals use
+        the distance field of the shared static layer (see StaticLayer.distance_field), and Manhattan
+        distances are used before any layer is received.
+        :param goal: (x,y) tuple.
+        :returns Function cell -> lower bound, or None if goal cannot be reached from the cell. Cells are
+        linearised as x * height + y, as in the path searches.
+        """
+        if self.__static_layer is None:
+            return lambda i: manhattan_distance(divmod(i, self.__grid_height), goal)
+        if goal == self.goal() and self.__latest_world_model is not None:
+            planner = self.__goal_distances
+            if planner is None or planner.goal != goal or planner.static_layer is not self.__static_layer:
+                planner = IncrementalPlanner(self.__static_layer, goal, self.__latest_world_model)
+                self.__goal_distances = planner
+            return planner.distance
+        distances = memoryview(self.__static_layer.distance_field(goal).ravel())
+
+        def distance(i):
+            d = distances[i]
+            return None if d == UNREACHABLE else d
+        return distance
+
     def find_path_BFS(self, origin, goal, ignore_agents=True):
         """
-        Finds a path using Breadth-First Search.
+        Finds a shortest path in space (ignoring time) using A*, guided by distances_to.
+        Cells are searched linearised as x * height + y, iterating the shared neighbour_table.
         :param origin: (x,y) tuple representing start.
         :param goal: (x,y) tuple representing destination.
         :return: Returns a list of tuples (cells) representing a path. If goal is unreachable, returns None.
         """
-        to_visit = collections.deque()
+        world_model = self.__latest_world_model
+        h = world_model.height
+        indptr, indices = (memoryview(table) for table in neighbour_table(world_model.width, h, 'von_neumann'))
+        open_cells, blocked = world_model.passable_cells()
+        open_cells = memoryview(open_cells)
+        distance_to_goal = self.distances_to(goal)
+        start, end = origin[0] * h + origin[1], goal[0] * h + goal[1]
+        to_visit = []
         came_from = {}
-        to_visit.append(origin)
-        came_from[origin] = None
+        distances = {}  # Shortest known distance from origin.
+        if distance_to_goal(start) is not None:
+            to_visit.append((distance_to_goal(start), 0, start))
+            came_from[start] = None
+            distances[start] = 0
         goal_found = False
 
-
         # Performs search and returns dict with previous steps for every vertex.
         while len(to_visit) > 0:
-            current = to_visit.popleft()
+            _, distance, current = heapq.heappop(to_visit)
+            if distance > distances[current]:
+                continue  # Already expanded through a shorter path.
 
-            if current == goal:  # Found goal!
+            if current == end:  # Found goal!
                 goal_found = True
                 break
 
-            for neighbour in self.__latest_world_model.neighbours_of(current, 'von_neumann'):
-                x, y = neighbour
-                cell_condition = self.__latest_world_model.cells[x][y] >= 0 if ignore_agents \
-                    else self.__latest_world_model.cells[x][y] == EMPTY
-                if neighbour not in came_from and cell_condition:
-                    to_visit.append(neighbour)
+            for neighbour in indices[indptr[current]:indptr[current + 1]]:
+                if not open_cells[neighbour] or neighbour in blocked:
+                    continue
+                if not ignore_agents and world_model.cell(divmod(neighbour, h)) != EMPTY:
+                    continue
+                if distances.get(neighbour, distance + 2) <= distance + 1:
+                    continue
+                estimate = distance_to_goal(neighbour)
+                if estimate is not None:
+                    heapq.heappush(to_visit, (distance + 1 + estimate, distance + 1, neighbour))
                     came_from[neighbour] = current
+                    distances[neighbour] = distance + 1
 
         if goal_found:  # Reconstructing path backwards from dict.
             path = list()
             path.append(goal)
-            current = came_from[goal]
-            while current != origin:
-                path.append(current)
+            current = came_from[end]
+            while current != start:
+                path.append(divmod(current, h))
                 current = came_from[current]
             path.append(origin)
             path.reverse()
@@ -257,88 +477,122 @@ class Agent:
         return None
 
     def find_path_3D_search(self, origin, goal, initial_time_step=None, concede_to_agents=True, timeout=100):
+        """
+        Finds a path through space and time using A*. Every move (including waiting) takes one time step,
+        so the cost of a state is its time step, and distances_to is an admissible heuristic. States that
+        cannot reach the goal before the timeout are not expanded.
+        States are expanded in order of (estimated arrival, time step, position). This order never decreases
+        along a move, so each state is reached from the first expanded state that can move into it. The path
+        found only depends on which states can be visited and on their estimates.
+        Cells are searched linearised as x * height + y, iterating the shared neighbour_table.
+        :param origin: ((x,y), time step) tuple representing start.
+        :param goal: (x,y) tuple representing destination.
+        :param initial_time_step: Time step the timeout counts from. Defaults to the current time step.
+        :param concede_to_agents: Avoids the estimated plans of the agents conceded to.
+        :param timeout: Maximum number of time steps after initial_time_step.
+        :return: Returns a list of (coord, time step) tuples. If goal is unreachable, returns None.
+        """
         # if self.__human_controlled is True:
         #     return self.__plan
         if initial_time_step is None:
             initial_time_step = self.__current_time_step
 
-        to_visit = collections.deque()
+        distance_to_goal = self.distances_to(goal)
+        deadline = initial_time_step + timeout  # Last time step the goal may be reached at.
+        conceded_plans = None
+        if concede_to_agents and len(self.__conceding_to_agents) > 0:
+            conceded_plans = ConcededPlans(self.__agents_estimated_plans[agent] for agent in self.__conceding_to_agents)
+            # Wait if not conceding: the goal is only reached after the last time they traverse it.
+            goal_wait_until = conceded_plans.last_occupied(goal) + 1
+        if conceded_plans is not None and Agent.SAFE_INTERVALS:
+            path, expansions, timed_out = find_path_safe_intervals(self.__latest_world_model, origin, goal,
+                                                                   conceded_plans, distance_to_goal, deadline)
+            self.__last_search_expansions = expansions
+            self.__search_expansions += expansions
+            if path is None:
+                if timed_out:
+                    print("Agent::find_path_3D_search: Search has timed out.".format(self.__agent_id))
+                print("Agent::find_path_3D_search: Agent {} could not reach its goal.".format(self.__agent_id))
+            return path
+        world_model = self.__latest_world_model
+        h = world_model.height
+        indptr, indices = (memoryview(table) for table in neighbour_table(world_model.width, h, 'von_neumann'))
+        open_cells, blocked = world_model.passable_cells()
+        open_cells = memoryview(open_cells)
+        start = (origin[POS][0] * h + origin[POS][1], origin[TIME_STEP])
+        end = goal[0] * h + goal[1]
+        to_visit = []
         came_from = {}
-        to_visit.append(origin)
-        came_from[origin] = None
+        came_from[start] = None
         goal_found = False
+        timed_out = False
+        expansions = 0
+        estimate = distance_to_goal(start[POS])
+        if estimate is not None:
+            if origin[TIME_STEP] + estimate <= deadline:
+                to_visit.append((origin[TIME_STEP] + estimate, origin[TIME_STEP], start[POS]))
+            else:
+                timed_out = True
 
         # Performs search and returns dict with previous steps for every vertex.
         while len(to_visit) > 0:
-            current = to_visit.popleft()
+            _, current_time_step, current_pos = heapq.heappop(to_visit)
+            current = (current_pos, current_time_step)
+            expansions += 1
 
-            if current[TIME_STEP] - initial_time_step > timeout:
-                print("Agent::find_path_3D_search: Search has timed out.".format(self.__agent_id))
+            if current[POS] == end and (conceded_plans is None or current[TIME_STEP] >= goal_wait_until):
+                goal_found = True  # Found goal!
                 break
 
-            if current[POS] == goal:  # Found goal!
-                if concede_to_agents and len(self.__conceding_to_agents) > 0:  # Wait if not conceding.
-                    # Calculate when it's the last occurrence that they traverse your cell.
-                    last_occurrence_time_step = 0
-                    for agent in self.__conceding_to_agents:
-                        for step in self.__agents_estimated_plans[agent]:
-                            if step[POS] == current[POS]:
-                                if last_occurrence_time_step < step[TIME_STEP]:
-                                    last_occurrence_time_step = step[TIME_STEP]
-                    if current[TIME_STEP] > last_occurrence_time_step:
-                        goal_found = True
-                        break
-                else:
-                    goal_found = True
-                    break
-
-            neighbours = self.__latest_world_model.neighbours_of(current[POS], 'von_neumann')
-            wait_step = current[POS]
-            neighbours.append(wait_step)
-
-            for neighbour in neighbours:
-                x, y = neighbour
+            # Neighbours followed by the wait step.
+            first, last = indptr[current_pos], indptr[current_pos + 1]
+            for k in range(first, last + 1):
+                neighbour = indices[k] if k < last else current_pos
                 neighbouring_step = (neighbour, current[TIME_STEP] + 1)
-                if neighbouring_step not in came_from and self.__latest_world_model.cells[x][y] >= 0:
-                    if concede_to_agents:
-                        conflict = False
-                        for agent in self.__conceding_to_agents:
-                            their_plan = self.__agents_estimated_plans[agent]
-                            my_position = (current[POS], current[TIME_STEP] + 1)
-                            coming_to_my_position = True if my_position in their_plan else False
-                            time_step = current[TIME_STEP]
-                            if current[TIME_STEP] >= their_plan[-1][TIME_STEP]:
-                                time_step = their_plan[-1][TIME_STEP]
-                            their_position = [pos for pos in their_plan if pos[TIME_STEP] == time_step][0]
-                            going_to_their_position = neighbouring_step == (their_position[POS], current[TIME_STEP] + 1)
-                            if neighbouring_step in their_plan:
-                                conflict = True
-                            elif coming_to_my_position and going_to_their_position:
-                                conflict = True
-
-                        if conflict:
-                            continue
-
-                    to_visit.append(neighbouring_step)
+                if neighbouring_step not in came_from and open_cells[neighbour] and neighbour not in blocked:
+                    if conceded_plans is not None and \
+                            (conceded_plans.occupied((divmod(neighbour, h), neighbouring_step[TIME_STEP])) or
+                             conceded_plans.swaps(divmod(current_pos, h), divmod(neighbour, h), current[TIME_STEP])):
+                        continue
+
+                    estimate = distance_to_goal(neighbour)
+                    if estimate is None:
+                        continue
+                    if neighbouring_step[TIME_STEP] + estimate > deadline:
+                        timed_out = True
+                        continue
+                    heapq.heappush(to_visit, (neighbouring_step[TIME_STEP] + estimate, neighbouring_step[TIME_STEP], neighbour))
                     came_from[neighbouring_step] = current
 
+        self.__last_search_expansions = expansions
+        self.__search_expansions += expansions
+
         if goal_found:  # Reconstructing path backwards from dict.
             path = list()
             path.append(current)
             current = came_from[current]
-            while current != origin and current is not None:
+            while current != start and current is not None:
                 path.append(current)
                 current = came_from[current]
-            path.append(origin)
+            path.append(start)
             path.reverse()
-            return path
+            return [(divmod(pos, h), time_step) for pos, time_step in path]
 
+        if timed_out:
+            print("Agent::find_path_3D_search: Search has timed out.".format(self.__agent_id))
         print("Agent::find_path_3D_search: Agent {} could not reach its goal.".format(self.__agent_id))
         return None
 
+    def search_expansions(self):
+        """
+        :returns Tuple (states expanded by the last find_path_3D_search call, states expanded by all calls).
+        """
+        return self.__last_search_expansions, self.__search_expansions
+
 
 
     def next_waypoints(self):
+        self.update_plan()
         if self.__plan is None:
             return None
         if len(self.__plan) < 2:
@@ -383,14 +637,18 @@ class Agent:
     def find_agents_in_range(self):
         # Listing agents in communication/visibility range.
         agents_in_range = {}
-        grid = self.__latest_world_model.cells
-        vr = self.__visibility_radius
-        pos = self.__current_pos
+        vr = self.visibility_radius()
+        pos = self.current_pos()
         time_step = self.__current_time_step
-        for i in range(self.__grid_width):
-            for j in range(self.__grid_height):
-                if is_agent(grid[i][j]) and in_visibility_range(vr, pos, (i, j)):
-                    agents_in_range[grid[i][j]] = ((i, j), time_step)
+        field_of_view = None
+        if self.__static_layer is not None:
+            field_of_view = self.__static_layer.visibility_mask(pos, vr)
+        # Only known agents are checked, in the same (x, y) order as a scan of the grid.
+        known_agents = sorted(self.__latest_world_model.agent_positions.items(), key=lambda item: item[1])
+        for agent_id, coord in known_agents:
+            if in_visibility_range(vr, pos, coord) and \
+                    (field_of_view is None or field_of_view[coord[0] - pos[0] + vr, coord[1] - pos[1] + vr]):
+                agents_in_range[agent_id] = (coord, time_step)
         return agents_in_range
 
     def communicate(self):
@@ -422,13 +680,13 @@ class Agent:
             south = min(y1, y2)
             north = max(y1, y2)
             for i in range(north - south + 1):
-                if self.__latest_world_model.cells[x1][south + i] == LOCAL_OBSTACLE:
+                if self.__latest_world_model.cell((x1, south + i)) == LOCAL_OBSTACLE:
                     obstructions.append(((x1, south + i), time_step + i))
         else:
             west = min(x1, x2)
             east = max(x1, x2)
             for i in range(east - west + 1):
-                if self.__latest_world_model.cells[west + i][y1] == LOCAL_OBSTACLE:
+                if self.__latest_world_model.cell((west + i, y1)) == LOCAL_OBSTACLE:
                     obstructions.append(((west + i, y1), time_step + i))
 
         return obstructions
@@ -450,6 +708,7 @@ class Agent:
 
     def receive_locution(self, sender_id, received_locution: Locution):
         log = ""
+        self.__pending_events = True
         print("Received locution {}".format(received_locution))
         if received_locution.act_type() == ActType.ASK:
             # It is a question. Requires reply.
@@ -477,6 +736,9 @@ class Agent:
                 log = "{0} informs {1} that their next waypoints are {2}".format(sender_id, self.__agent_id, their_next_waypoints)
                 Broadcaster().publish("/log/raw", log)
 
+                if sender_id in self.__conceding_to_agents:
+                    # Their estimated plan constrains ours: a pending replan must see the previous one.
+                    self.update_plan()
                 # Check if the other agent is in collision route with any obstacle or agent.
                 self.__other_agents_waypoints[sender_id] = their_next_waypoints
                 their_position = self.find_agents_in_range()[sender_id]
@@ -486,6 +748,7 @@ class Agent:
                     return
                 obstructions = []
                 self.__agents_estimated_plans[sender_id] = []
+                self.__constraints_version += 1
                 start = their_position
                 for waypoint in their_next_waypoints:
                     obs = self.straight_line_obstructions(start, waypoint)
@@ -506,8 +769,12 @@ class Agent:
 
                     self.__agents_estimated_plan_lengths[sender_id] = len(self.__agents_estimated_plans[sender_id])
                     print("Estimated path of agent {}: {}".format(sender_id, self.__agents_estimated_plans[sender_id]))
-                    conflict = find_conflicts_between_paths(self.__plan, self.__agents_estimated_plans[sender_id], self.__current_time_step, 4)
-                    illegal_swap_time_step = illegal_position_swap(self.__plan, self.__agents_estimated_plans[sender_id], 4)
+                    self.update_plan()
+                    their_plan = self.__agents_estimated_plans[sender_id]
+                    if their_plan[-1][TIME_STEP] < self.__plan[-1][TIME_STEP]:
+                        # Conceding to them assumes they wait at the end of their estimated plan.
+                        grow_path(their_plan, self.__plan[-1][TIME_STEP] - their_plan[-1][TIME_STEP])
+                    conflict, illegal_swap_time_step = self.__conflicts_with(sender_id, 4)
                     print("Conflict? {}".format(conflict))
                     print("Swap? {}".format(illegal_swap_time_step))
 
@@ -552,6 +819,9 @@ class Agent:
 
         elif received_locution.act_type() == ActType.ARGUE:
             if received_locution.content_type() == ContentType.ARGUMENT:
+                # Conceding changes the constraints of the plan (and so may this, as after conceding
+                # the set of agents negotiated with is the set of agents conceded to).
+                self.update_plan()
                 self.__negotiated_with.add(sender_id)
                 AF = self.__culture.argumentation_framework
                 # Read useful information from their argument.
@@ -605,7 +875,7 @@ class Agent:
                     unsuccessful_arguments = self.__arguments_used_this_round
                     locution = Locution(ActType.CONCEDE, ContentType.MULTIPLE_ARGUMENTS, failed_arguments=list(unsuccessful_arguments))
                     self.__simulator.send_locution(self.__agent_id, sender_id, locution)
-                    log = "{0} rerouted to {1}".format(self.__agent_id, self.__plan)
+                    log = "{0} rerouted to {1}".format(self.__agent_id, self.latest_plan())
                     Broadcaster().publish("/log/raw", log)
 
         elif received_locution.act_type() == ActType.CONCEDE:
@@ -664,9 +934,39 @@ class Agent:
 
             Broadcaster().publish("/model_updated")
 
+    def __conflicts_with(self, agent_id, first_n_cells):
+        """
+        Checks the first cells of the plan against the plan another agent reserved in the simulator's
+        reservation table. Both agents are assumed to wait at the end of their plans.
+        :param agent_id: Agent whose reservations are checked.
+        :param first_n_cells: Number of cells of the plan checked.
+        :returns Tuple (first step of the plan the other agent has reserved, time step at which both agents
+        would swap cells). Either may be None.
+        """
+        reservations = self.__simulator.reservations()
+        plan = self.__plan
+        last_pos, last_time_step = plan[-1]
+        num_steps = first_n_cells + self.__current_time_step - plan[0][TIME_STEP]
+
+        conflict = None
+        for i in range(num_steps):
+            step = plan[i] if i < len(plan) else (last_pos, last_time_step + i - len(plan) + 1)
+            if reservations.is_reserved(*step, by_agent=agent_id):
+                conflict = step
+                break
+
+        illegal_swap_time_step = None
+        for i in range(min(first_n_cells, len(plan)) - 1):
+            (pos, time_step), (next_pos, _) = plan[i], plan[i + 1]
+            if agent_id in reservations.swapping_agents(pos, next_pos, time_step):
+                illegal_swap_time_step = time_step
+                break
+        return conflict, illegal_swap_time_step
+
     def reroute_avoiding(self):
-        self.__plan = self.find_path_3D_search((self.__current_pos, self.__current_time_step), self.__goal)
-        print("Agent {} Rerouting: {}".format(self.__agent_id, self.__plan))
+        self.__plan_dirty = True
+        self.__update_status()
+        print("Agent {} Rerouting.".format(self.__agent_id))
 
 
     def clear_negotiation_status(self):
@@ -675,23 +975,52 @@ class Agent:
         self.__current_conflict = None
 
     def current_pos(self):
-        return self.__current_pos
+        return self.__registry.position(self.__agent_id)
 
     def latest_world_model(self):
         return self.__latest_world_model.cells
 
     def world_model_at(self, t):
-        return self.__previous_world_models[t].cells
+        """
+        :returns Cells of the world model at time step t. None if the history no longer holds it (see HISTORY_POLICY).
+        """
+        world_model = self.__previous_world_models.get(t, None)
+        if world_model is None:
+            return None
+        return world_model.cells
 
     def latest_plan(self):
+        self.update_plan()
         return self.__plan
 
+    def plan_head(self, t):
+        """
+        Reads the plan as currently held, without replanning (e.g. for tracing).
+        :param t: Time step.
+        :returns First (coord, time step) tuple of the plan after time step t. None if there is none.
+        """
+        for step in self.__plan or ():
+            if step[TIME_STEP] > t:
+                return step
+        return None
+
+    def __set_plan(self, plan):
+        self.__plan = plan
+        self.__plan_dirty = False
+        self.__update_status()
+        # Keeps the simulator's reservation table in sync.
+        self.__simulator.plan_changed(self.__agent_id, plan)
+
     def plan_at(self, t):
+        if t == self.__current_time_step:
+            self.update_plan()
         return self.__previous_plans.get(t, None)
 
     def optimal_plan_at(self, t):
+        if t == self.__current_time_step:
+            return self.optimal_plan()
         return self.__previous_optimal_plans.get(t, None)
 
     def goal(self):
-        return self.__goal
+        return self.__registry.goal(self.__agent_id)
 
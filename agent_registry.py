@@ -0,0 +1,177 @@
+import heapq
+import numpy as np
+
+DEFAULT_CAPACITY = 64
+NO_COORD = -1  # Value of position and goal columns that are not set.
+
+# Agent status values.
+ACTIVE = 0  # Has a plan to follow (or is controlled by a human).
+AT_GOAL = 1  # Parked at its goal.
+WAITING = 2  # No plan and nothing to negotiate. Only replans when an event wakes it.
+AGENT_STATUSES = (ACTIVE, AT_GOAL, WAITING)
+
+
+class AgentRegistry:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        Per-agent state stored column-wise, one row per registered agent:
+        position, goal, status, visibility radius and culture properties.
+        Agent ids are allocated lowest-first, reusing the ids of removed agents.
+        :param capacity: Initial number of rows. Columns grow as needed.
+        """
+        self.ids = np.zeros(capacity, dtype=np.int32)  # 0 marks a free row.
+        self.positions = np.full((capacity, 2), NO_COORD, dtype=np.int32)
+        self.goals = np.full((capacity, 2), NO_COORD, dtype=np.int32)
+        self.status = np.full(capacity, ACTIVE, dtype=np.int8)
+        self.visibility_radii = np.zeros(capacity, dtype=np.int16)
+        self.__properties = {}  # Property name -> (values column, is-set column).
+        self.__rows = {}  # Agent id -> row.
+        self.__free_rows = []
+        self.__num_rows = 0
+        self.__free_ids = []  # Heap of unused ids below self.__next_id.
+        self.__next_id = 1
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def __contains__(self, agent_id):
+        return agent_id in self.__rows
+
+    def agent_ids(self):
+        return list(self.__rows.keys())
+
+    def row(self, agent_id):
+        return self.__rows[agent_id]
+
+    def rows(self, agent_ids):
+        """
+        :returns Numpy 1D array with the rows of the given agents.
+        """
+        return np.fromiter((self.__rows[agent_id] for agent_id in agent_ids), dtype=np.int64, count=len(agent_ids))
+
+    def free_ids(self, num_ids):
+        """
+        :param num_ids: Number of ids.
+        :returns List of the lowest agent ids not in use. They are not reserved until registered.
+        """
+        free_ids = heapq.nsmallest(num_ids, self.__free_ids)
+        free_ids += range(self.__next_id, self.__next_id + num_ids - len(free_ids))
+        return free_ids
+
+    def register(self, agent_id, visibility_radius=0):
+        """
+        Adds a row for an agent.
+        :returns Row of the agent. None if the id is already registered.
+        """
+        if agent_id in self.__rows:
+            print("AgentRegistry::register: Agent {} already registered.".format(agent_id))
+            return None
+        if agent_id >= self.__next_id:
+            for free_id in range(self.__next_id, agent_id):
+                heapq.heappush(self.__free_ids, free_id)
+            self.__next_id = agent_id + 1
+        else:
+            self.__free_ids.remove(agent_id)
+            heapq.heapify(self.__free_ids)
+
+        if len(self.__free_rows) > 0:
+            row = self.__free_rows.pop()
+        else:
+            if self.__num_rows == len(self.ids):
+                self.__grow()
+            row = self.__num_rows
+            self.__num_rows += 1
+        self.__rows[agent_id] = row
+        self.ids[row] = agent_id
+        self.positions[row] = NO_COORD
+        self.goals[row] = NO_COORD
+        self.status[row] = ACTIVE
+        self.visibility_radii[row] = visibility_radius
+        for values, is_set in self.__properties.values():
+            is_set[row] = False
+        return row
+
+    def unregister(self, agent_id):
+        row = self.__rows.pop(agent_id, None)
+        if row is None:
+            return
+        self.ids[row] = 0
+        self.__free_rows.append(row)
+        heapq.heappush(self.__free_ids, agent_id)
+
+    def __grow(self):
+        capacity = 2 * len(self.ids)
+        self.ids = np.resize(self.ids, capacity)
+        self.ids[self.__num_rows:] = 0
+        self.positions = np.resize(self.positions, (capacity, 2))
+        self.goals = np.resize(self.goals, (capacity, 2))
+        self.status = np.resize(self.status, capacity)
+        self.visibility_radii = np.resize(self.visibility_radii, capacity)
+        for name, (values, is_set) in self.__properties.items():
+            is_set = np.resize(is_set, capacity)
+            is_set[self.__num_rows:] = False
+            self.__properties[name] = (np.resize(values, capacity), is_set)
+
+    @staticmethod
+    def __coord(values):
+        if values[0] == NO_COORD:
+            return None
+        return int(values[0]), int(values[1])
+
+    def position(self, agent_id):
+        return self.__coord(self.positions[self.__rows[agent_id]])
+
+    def set_position(self, agent_id, coord):
+        self.positions[self.__rows[agent_id]] = NO_COORD if coord is None or coord is False else coord
+
+    def goal(self, agent_id):
+        return self.__coord(self.goals[self.__rows[agent_id]])
+
+    def set_goal(self, agent_id, coord):
+        self.goals[self.__rows[agent_id]] = NO_COORD if coord is None or coord is False else coord
+
+    def has_property(self, agent_id, name):
+        column = self.__properties.get(name, None)
+        return column is not None and bool(column[1][self.__rows[agent_id]])
+
+    def property(self, agent_id, name, default=None):
+        column = self.__properties.get(name, None)
+        row = self.__rows[agent_id]
+        if column is None or not column[1][row]:
+            return default
+        value = column[0][row]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def set_property(self, agent_id, name, value):
+        """
+        Sets a culture property. Integer and float properties get numeric columns; anything else
+        (e.g. strings) is stored in an object column.
+        """
+        column = self.__properties.get(name, None)
+        if column is None:
+            if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+                dtype = np.int64
+            elif isinstance(value, (float, np.floating)):
+                dtype = np.float64
+            else:
+                dtype = object
+            column = (np.zeros(len(self.ids), dtype=dtype), np.zeros(len(self.ids), dtype=bool))
+            self.__properties[name] = column
+        values, is_set = column
+        if values.dtype != object and np.asarray(value).dtype.kind not in 'iu' + ('f' if values.dtype.kind == 'f' else ''):
+            values = values.astype(object)
+            self.__properties[name] = (values, is_set)
+        row = self.__rows[agent_id]
+        values[row] = value
+        is_set[row] = True
+
+    def property_column(self, name):
+        """
+        :returns Tuple (agent ids, values) of numpy arrays with every agent that has the property set.
+        """
+        column = self.__properties.get(name, None)
+        if column is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        values, is_set = column
+        selected = is_set & (self.ids > 0)
+        return self.ids[selected], values[selected]
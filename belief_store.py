@@ -0,0 +1,85 @@
+import numpy as np
+
+from grid2d import EMPTY
+from chunked_grid import new_layer
+
+NEVER_SEEN = -1
+
+
+class BeliefStore:
+    def __init__(self, w, h):
+        """
+        What an agent knows about the map, stored as arrays:
+        a value layer (cell values as in Grid2D.cells), a layer with the time step each cell was last
+        seen (NEVER_SEEN if unknown) and an index with the cell where each agent was last seen.
+        Each agent id is believed to be in at most one cell.
+        :param w: width of 2D grid
+        :param h: height of 2D grid
+        """
+        self.width = w
+        self.height = h
+        self.values = new_layer(w, h, np.int32, EMPTY)
+        self.last_seen = new_layer(w, h, np.int32, NEVER_SEEN)
+        self.agent_positions = {}  # Agent id -> (x,y) where it was last seen.
+
+    def merge(self, xs, ys, values, time_step):
+        """
+        Merges new information, overwriting conflicting beliefs. An agent seen in a new cell
+        is erased from the cell it was previously believed to be in.
+        :param xs: Numpy 1D integer array of x coordinates (no repeated cells).
+        :param ys: Numpy 1D integer array of y coordinates.
+        :param values: Numpy 1D integer array of cell values.
+        :param time_step: Time step the information refers to.
+        :returns dict {key=coord (x,y tuple), value=cell (int)} with every cell that was written.
+        """
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int32)
+        if xs.size == 0:
+            return {}
+
+        # Agents believed to be in overwritten cells are no longer known to be anywhere.
+        previous = self.values[xs, ys]
+        overwritten = (previous > 0) & (self.last_seen[xs, ys] != NEVER_SEEN)
+        for x, y, agent_id in zip(xs[overwritten].tolist(), ys[overwritten].tolist(), previous[overwritten].tolist()):
+            if self.agent_positions.get(agent_id, None) == (x, y):
+                del self.agent_positions[agent_id]
+
+        self.values[xs, ys] = values
+        self.last_seen[xs, ys] = time_step
+        changes = dict(zip(zip(xs.tolist(), ys.tolist()), values.tolist()))
+
+        # Agents seen elsewhere are erased from their previous cell.
+        agents = values > 0
+        for x, y, agent_id in zip(xs[agents].tolist(), ys[agents].tolist(), values[agents].tolist()):
+            seen_at = self.agent_positions.get(agent_id, None)
+            if seen_at is not None and seen_at != (x, y):
+                self.values[seen_at[0], seen_at[1]] = EMPTY
+                changes[seen_at] = EMPTY
+            self.agent_positions[agent_id] = (x, y)
+        return changes
+
+    def merge_cells(self, cells, time_step):
+        """
+        Same as merge, for a dict {key=coord (x,y tuple), value=cell (int)}.
+        """
+        coords = np.array(list(cells.keys()), dtype=np.int64).reshape(-1, 2)
+        values = np.array(list(cells.values()), dtype=np.int32)
+        return self.merge(coords[:, 0], coords[:, 1], values, time_step)
+
+    def known_cells(self):
+        """
+        :returns dict {key=coord (x,y tuple), value=cell (int)} with every known cell that is not empty.
+        """
+        values = np.asarray(self.values)
+        xs, ys = np.nonzero((np.asarray(self.last_seen) != NEVER_SEEN) & (values != EMPTY))
+        return dict(zip(zip(xs.tolist(), ys.tolist()), values[xs, ys].tolist()))
+
+    def materialise(self, grid):
+        """
+        Writes every known cell onto a blank grid.
+        :param grid: Grid2D instance (or subclass).
+        :returns grid
+        """
+        grid.write_cells(self.known_cells())
+        return grid
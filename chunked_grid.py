@@ -0,0 +1,147 @@
+import numpy as np
+
+from grid2d import Grid2D, EMPTY
+
+CHUNK_SIZE = 64
+# Maps with more cells than this are stored in chunks by new_grid.
+CHUNKED_GRID_MIN_CELLS = 256 * 256
+
+
+class ChunkedLayer:
+    def __init__(self, shape, dtype=np.int8, fill_value=EMPTY, chunk_size=CHUNK_SIZE):
+        """
+        Sparse 2D layer split into square chunks that are only allocated on first write.
+        Cells in unallocated chunks read as fill_value.
+        Supports [x, y], [xs, ys] (integer arrays) and boolean mask indexing, and np.asarray.
+        :param shape: (width, height) tuple.
+        :param dtype: Numpy dtype of the cells.
+        :param fill_value: Value of cells that were never written.
+        :param chunk_size: Side of each square chunk.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        self.chunk_size = chunk_size
+        self.__chunks = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    def num_allocated_chunks(self):
+        return len(self.__chunks)
+
+    def __coords(self, key):
+        """
+        Normalises an index to two integer arrays of coordinates.
+        """
+        if isinstance(key, tuple):
+            xs, ys = key
+            return np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        mask = np.asarray(key)
+        if mask.dtype != bool or mask.shape != self.shape:
+            raise IndexError("ChunkedLayer only supports [x, y] and boolean mask indexing.")
+        return np.nonzero(mask)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and np.isscalar(key[0]) and np.isscalar(key[1]):
+            x, y = key
+            chunk = self.__chunks.get((x // self.chunk_size, y // self.chunk_size), None)
+            if chunk is None:
+                return self.dtype.type(self.fill_value)
+            return chunk[x % self.chunk_size, y % self.chunk_size]
+
+        xs, ys = self.__coords(key)
+        values = np.full(xs.shape, self.fill_value, dtype=self.dtype)
+        for chunk_key, selection in self.__group_by_chunk(xs, ys):
+            chunk = self.__chunks.get(chunk_key, None)
+            if chunk is not None:
+                values[selection] = chunk[xs[selection] % self.chunk_size, ys[selection] % self.chunk_size]
+        return values
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple) and np.isscalar(key[0]) and np.isscalar(key[1]):
+            x, y = key
+            chunk = self.__chunk_for_write((x // self.chunk_size, y // self.chunk_size), value)
+            if chunk is not None:
+                chunk[x % self.chunk_size, y % self.chunk_size] = value
+            return
+
+        xs, ys = self.__coords(key)
+        values = np.broadcast_to(np.asarray(value, dtype=self.dtype), xs.shape)
+        for chunk_key, selection in self.__group_by_chunk(xs, ys):
+            chunk = self.__chunk_for_write(chunk_key, values[selection])
+            if chunk is not None:
+                chunk[xs[selection] % self.chunk_size, ys[selection] % self.chunk_size] = values[selection]
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.full(self.shape, self.fill_value, dtype=self.dtype if dtype is None else dtype)
+        for (cx, cy), chunk in self.__chunks.items():
+            x, y = cx * self.chunk_size, cy * self.chunk_size
+            dense[x:x + chunk.shape[0], y:y + chunk.shape[1]] = chunk
+        return dense
+
+    def __group_by_chunk(self, xs, ys):
+        """
+        Yields (chunk key, boolean selection) for every chunk touched by the given coordinates.
+        """
+        if xs.size == 0:
+            return
+        chunk_xs = xs // self.chunk_size
+        chunk_ys = ys // self.chunk_size
+        chunk_ids = chunk_xs * (self.shape[1] // self.chunk_size + 1) + chunk_ys
+        for chunk_id in np.unique(chunk_ids):
+            selection = chunk_ids == chunk_id
+            first = np.argmax(selection)
+            yield (int(chunk_xs[first]), int(chunk_ys[first])), selection
+
+    def __chunk_for_write(self, chunk_key, values):
+        """
+        Returns the chunk to write to, allocating it unless only fill values are being written.
+        """
+        chunk = self.__chunks.get(chunk_key, None)
+        if chunk is None:
+            if np.all(np.asarray(values) == self.fill_value):
+                return None
+            cx, cy = chunk_key
+            width = min(self.chunk_size, self.shape[0] - cx * self.chunk_size)
+            height = min(self.chunk_size, self.shape[1] - cy * self.chunk_size)
+            chunk = np.full((width, height), self.fill_value, dtype=self.dtype)
+            self.__chunks[chunk_key] = chunk
+        return chunk
+
+
+class ChunkedGrid2D(Grid2D):
+    """
+    Grid2D whose cell classes are stored in a ChunkedLayer, so only the regions of the map
+    that contain obstacles or agents use memory. Cell accessors are the same as Grid2D.
+    """
+
+    @staticmethod
+    def new_cell_layer(w, h):
+        return ChunkedLayer((w, h))
+
+
+def new_grid(w, h):
+    """
+    Constructs a blank grid, using chunked storage for very large maps.
+    :param w: width of 2D grid
+    :param h: height of 2D grid
+    :returns Grid2D or ChunkedGrid2D instance.
+    """
+    if w * h > CHUNKED_GRID_MIN_CELLS:
+        return ChunkedGrid2D(w, h)
+    return Grid2D(w, h)
+
+
+def new_layer(w, h, dtype, fill_value):
+    """
+    Allocates a standalone 2D layer, chunked for very large maps (same threshold as new_grid).
+    :param w: width of 2D grid
+    :param h: height of 2D grid
+    :param dtype: Numpy dtype of the cells.
+    :param fill_value: Initial value of every cell.
+    :returns Numpy 2D array or ChunkedLayer instance.
+    """
+    if w * h > CHUNKED_GRID_MIN_CELLS:
+        return ChunkedLayer((w, h), dtype=dtype, fill_value=fill_value)
+    return np.full((w, h), fill_value, dtype=dtype)
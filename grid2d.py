@@ -1,9 +1,66 @@
+import copy
+import functools
 import numpy as np
 import traceback
 
 EMPTY = 0
 GLOBAL_OBSTACLE = -1
 LOCAL_OBSTACLE = -2
+AGENT_CELL = 1  # Cell class of cells occupied by an agent. Not an agent id.
+
+# Neighbour offsets in the order they are returned by Grid2D.neighbours_of.
+NEIGHBOURHOOD_OFFSETS = {
+    'von_neumann': ((-1, 0), (1, 0), (0, -1), (0, 1)),  # Left, right, up, down.
+    'moore': tuple((i, j) for i in range(-1, 2) for j in range(-1, 2) if not i == j == 0),
+}
+
+
+NEIGHBOUR_TABLE_CACHE_SIZE = 4  # Number of (w, h, neighbourhood type) tables kept by neighbour_table.
+
+
+@functools.lru_cache(maxsize=NEIGHBOUR_TABLE_CACHE_SIZE)
+def neighbour_table(w, h, neighbourhood_type='von_neumann'):
+    """
+    Builds a CSR-style table of in-bounds neighbours for every cell of a w x h grid, for searches that
+    work on linearised cells (the path searches of Agent and IncrementalPlanner). Obstacles are not part of it:
+    searches check the neighbours they iterate against Grid2D.passable_cells, so the table never changes.
+    Cells are linearised as x * h + y. The neighbours of cell i are
+    indices[indptr[i]:indptr[i + 1]], in the same order as Grid2D.neighbours_of.
+    Tables only depend on the dimensions, so they are shared, and only the most recently used sizes are kept.
+    A table takes 4 bytes per cell plus 4 bytes per neighbour (at most 20 bytes per cell for von Neumann
+    neighbourhoods and 36 for Moore ones).
+    :param w: width of 2D grid
+    :param h: height of 2D grid
+    :param neighbourhood_type: 'von_neumann' or 'moore'.
+    :returns Tuple (indptr, indices) of read-only numpy arrays.
+    """
+    offsets = np.array(NEIGHBOURHOOD_OFFSETS[neighbourhood_type])
+    xs, ys = np.meshgrid(np.arange(w), np.arange(h), indexing='ij')
+    neighbour_xs = xs.reshape(-1, 1) + offsets[:, 0]
+    neighbour_ys = ys.reshape(-1, 1) + offsets[:, 1]
+    valid = (neighbour_xs >= 0) & (neighbour_xs < w) & (neighbour_ys >= 0) & (neighbour_ys < h)
+    indptr = np.zeros(w * h + 1, dtype=np.int32)
+    np.cumsum(valid.sum(axis=1), out=indptr[1:])
+    indices = (neighbour_xs * h + neighbour_ys)[valid].astype(np.int32)
+    indptr.flags.writeable = False
+    indices.flags.writeable = False
+    return indptr, indices
+
+
+def rectangle_mask(w, h, corner_a, corner_b):
+    """
+    Builds a boolean mask selecting an axis-aligned rectangle of cells (inclusive).
+    :param w: width of 2D grid
+    :param h: height of 2D grid
+    :param corner_a: (x,y) tuple of one corner.
+    :param corner_b: (x,y) tuple of the opposite corner.
+    :returns Numpy 2D boolean array.
+    """
+    mask = np.zeros((w, h), dtype=bool)
+    x1, x2 = sorted((corner_a[0], corner_b[0]))
+    y1, y2 = sorted((corner_a[1], corner_b[1]))
+    mask[max(x1, 0):x2 + 1, max(y1, 0):y2 + 1] = True
+    return mask
 
 
 class Grid2D:
@@ -12,15 +69,82 @@ class Grid2D:
         Constructs blank grid containing only empty spaces.
         Cell occupancy in this grid can be represented as EMPTY (0), OBSTACLE (-1),
         or by agent ids (positive integers).
+        Internally, cells are stored as an int8 layer of cell classes (EMPTY, GLOBAL_OBSTACLE,
+        LOCAL_OBSTACLE or AGENT_CELL) and agent ids are only stored for the cells agents sit on.
         :param w: width of 2D grid
         :param h: height of 2D grid
         """
         self.width = w
         self.height = h
 
-        self.cells = np.zeros((w, h), dtype=np.int)
+        self.cell_types = self.new_cell_layer(w, h)
+        self.agents_at = {}
 
         self.agent_positions = {}
+        self.obstacle_version = 0  # Bumped whenever a global obstacle is added or removed.
+
+        self.__cells = None
+
+    @staticmethod
+    def new_cell_layer(w, h):
+        """
+        Allocates the layer of cell classes. Subclasses may return any array-like layer that
+        supports [x, y] and boolean mask indexing, as well as np.asarray.
+        """
+        return np.zeros((w, h), dtype=np.int8)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The compatibility view is rebuilt on demand, so copies do not carry it around.
+        state['_Grid2D__cells'] = None
+        return state
+
+    @classmethod
+    def from_cells(cls, cells):
+        """
+        Constructs a grid from an array of cell values (as returned by Grid2D.cells).
+        Agent positions are recovered from the cells holding agent ids.
+        :param cells: Numpy 2D array of cell values.
+        :returns Grid2D instance.
+        """
+        grid = cls(*cells.shape)
+        occupied = cells != EMPTY
+        grid.cell_types[occupied] = np.where(cells > 0, AGENT_CELL, cells)[occupied]
+        if np.any(cells == GLOBAL_OBSTACLE):
+            grid.obstacle_version += 1
+        for x, y in np.argwhere(cells > 0):
+            coord = (int(x), int(y))
+            agent_id = int(cells[x][y])
+            grid.agents_at[coord] = agent_id
+            grid.agent_positions[agent_id] = coord
+        return grid
+
+    @property
+    def cells(self):
+        """
+        Read-only compatibility view with one int32 value per cell: EMPTY, GLOBAL_OBSTACLE,
+        LOCAL_OBSTACLE or the id of the agent occupying it. It is cached until the grid changes.
+        :returns Numpy 2D array.
+        """
+        if self.__cells is None:
+            cells = np.asarray(self.cell_types).astype(np.int32)
+            for (x, y), agent_id in self.agents_at.items():
+                cells[x][y] = agent_id
+            cells.flags.writeable = False
+            self.__cells = cells
+        return self.__cells
+
+    def cell(self, coord):
+        """
+        Returns the value of a single cell without building the compatibility view.
+        :param coord: Position of the cell.
+        :returns EMPTY, GLOBAL_OBSTACLE, LOCAL_OBSTACLE or an agent id.
+        """
+        x, y = coord
+        cell_type = self.cell_types[x, y]
+        if cell_type == AGENT_CELL:
+            return self.agents_at[(x, y)]
+        return int(cell_type)
 
     def within_bounds(self, coord):
         """
@@ -28,10 +152,8 @@ class Grid2D:
         :param coord: Position to check.
         :returns True if within bounds. False otherwise.
         """
-        wr = range(0, self.width)
-        hr = range(0, self.height)
         x, y = coord
-        return x in wr and y in hr
+        return 0 <= x < self.width and 0 <= y < self.height
 
     def neighbours_of(self, coord, neighbourhood_type='von_neumann'):
         """
@@ -43,29 +165,29 @@ class Grid2D:
         if not self.within_bounds(coord):
             print("Grid2D::neighbours_of: Position out of bounds.")
             return None
-        x, y = coord
-        neighbours = []
-        if neighbourhood_type == 'von_neumann':
-            if self.within_bounds((x - 1, y)): neighbours.append((x - 1, y))  # Left
-            if self.within_bounds((x + 1, y)): neighbours.append((x + 1, y))  # Right
-            if self.within_bounds((x, y - 1)): neighbours.append((x, y - 1))  # Up
-            if self.within_bounds((x, y + 1)): neighbours.append((x, y + 1))  # Down
-        elif neighbourhood_type == 'moore':
-            for i in range(-1, 2):
-                for j in range(-1, 2):
-                    if i == j == 0: continue
-                    if self.within_bounds((x + i, y + j)): neighbours.append((x + i, y + j))
-        else:
+        if neighbourhood_type not in NEIGHBOURHOOD_OFFSETS:
             print("Grid2D::neighbours_of: This neighbourhood type is not supported.")
             return None
-        return neighbours
+        x, y = coord
+        w, h = self.width, self.height
+        return [(x + i, y + j) for i, j in NEIGHBOURHOOD_OFFSETS[neighbourhood_type] if 0 <= x + i < w and 0 <= y + j < h]
+
+    def passable_cells(self):
+        """
+        Passable cells (EMPTY or agents) for searches over linearised cells (x * height + y), which iterate
+        neighbour_table and check each neighbour here instead of building neighbourhoods per cell.
+        This grid builds a flat mask from its cell layer on every call (see OverlayGrid2D for a shared one).
+        :returns Tuple (open_cells, blocked): a flat boolean array, False where there is an obstacle, and a set
+        of further cells that are obstacles despite being open in open_cells.
+        """
+        return (np.asarray(self.cell_types) >= 0).ravel(), frozenset()
 
     def is_cell_empty(self, coord):
         if not self.within_bounds(coord):
             print("Grid2D::neighbours_of: Position out of bounds.")
             return False
         x, y = coord
-        return self.cells[x][y] == EMPTY
+        return self.cell_types[x, y] == EMPTY
 
     def add_obstacle(self, coord, type=GLOBAL_OBSTACLE):
         """
@@ -78,10 +200,13 @@ class Grid2D:
         if not self.within_bounds(coord):
             print("Grid2D::add_obstacle: Position out of bounds.")
             return False
-        if self.cells[x][y] != EMPTY:
+        if self.cell_types[x, y] != EMPTY:
             print("Grid2D::add_obstacle: Trying to add obstacle to non-empty cell.")
             return False
-        self.cells[x][y] = type
+        self.cell_types[x, y] = type
+        self.__cells = None
+        if type == GLOBAL_OBSTACLE:
+            self.obstacle_version += 1
         return True
 
     def remove_obstacle(self, coord):
@@ -94,13 +219,108 @@ class Grid2D:
             print("Grid2D::remove_obstacle: Position out of bounds.")
             return False
         x, y = coord
-        if Grid2D.is_obstacle(self.cells[x][y]):
-            self.cells[x][y] = EMPTY
+        if Grid2D.is_obstacle(self.cell_types[x, y]):
+            if self.cell_types[x, y] == GLOBAL_OBSTACLE:
+                self.obstacle_version += 1
+            self.cell_types[x, y] = EMPTY
+            self.__cells = None
             return True
 
         print("Grid2D::remove_obstacle: There is no obstacle to remove at this cell.")
         return False
 
+    def as_mask(self, cells):
+        """
+        Normalises a selection of cells to a boolean mask.
+        :param cells: Numpy 2D boolean array with the grid dimensions, or a sequence of (x,y) tuples.
+        :returns Numpy 2D boolean array. None if the selection is invalid or out of bounds.
+        """
+        cells = np.asarray(cells)
+        if cells.dtype == bool:
+            if cells.shape != (self.width, self.height):
+                print("Grid2D::as_mask: Mask does not match grid dimensions.")
+                return None
+            return cells
+        coords = cells.reshape(-1, 2).astype(np.int64)
+        xs, ys = coords[:, 0], coords[:, 1]
+        if np.any((xs < 0) | (xs >= self.width) | (ys < 0) | (ys >= self.height)):
+            print("Grid2D::as_mask: Position(s) out of bounds.")
+            return None
+        mask = np.zeros((self.width, self.height), dtype=bool)
+        mask[xs, ys] = True
+        return mask
+
+    def add_obstacles(self, cells, type=GLOBAL_OBSTACLE):
+        """
+        Adds obstacles to several cells at once. Nothing is changed if any of them is not empty.
+        :param cells: Boolean mask or sequence of (x,y) tuples (see as_mask).
+        :param type: Type of obstacle (GLOBAL_OBSTACLE or LOCAL_OBSTACLE).
+        :returns True if successful. False if out of bounds or any cell is not empty.
+        """
+        mask = self.as_mask(cells)
+        if mask is None:
+            return False
+        if np.any(self.cell_types[mask] != EMPTY):
+            print("Grid2D::add_obstacles: Trying to add obstacles to non-empty cells.")
+            return False
+        self.cell_types[mask] = type
+        self.__cells = None
+        if type == GLOBAL_OBSTACLE:
+            self.obstacle_version += 1
+        return True
+
+    def remove_obstacles(self, cells):
+        """
+        Removes every obstacle found within the selected cells. Other cells are left untouched.
+        :param cells: Boolean mask or sequence of (x,y) tuples (see as_mask).
+        :returns Boolean mask of the cells that were cleared. None if the selection is invalid.
+        """
+        mask = self.as_mask(cells)
+        if mask is None:
+            return None
+        values = self.cell_types[mask]
+        cleared = np.zeros_like(mask)
+        cleared[mask] = values < 0
+        if np.any(values == GLOBAL_OBSTACLE):
+            self.obstacle_version += 1
+        self.cell_types[cleared] = EMPTY
+        self.__cells = None
+        return cleared
+
+    def place_agents(self, coords, agent_ids):
+        """
+        Adds several agents at once. Nothing is changed if any target cell is not empty,
+        if two agents share a cell or if an agent is already in the grid.
+        :param coords: Sequence of (x,y) tuples.
+        :param agent_ids: Sequence of agent ids, one per coordinate.
+        :returns True if successful. False otherwise.
+        """
+        coords = [(int(x), int(y)) for x, y in coords]
+        agent_ids = [int(agent_id) for agent_id in agent_ids]
+        if len(coords) != len(agent_ids):
+            print("Grid2D::place_agents: Number of coordinates and agent ids differ.")
+            return False
+        if len(coords) == 0:
+            return True
+        mask = self.as_mask(coords)
+        if mask is None:
+            return False
+        if len(set(coords)) != len(coords) or len(set(agent_ids)) != len(agent_ids):
+            print("Grid2D::place_agents: Repeated coordinates or agent ids.")
+            return False
+        if min(agent_ids) < 1 or any(agent_id in self.agent_positions for agent_id in agent_ids):
+            print("Grid2D::place_agents: Invalid or already placed agent ids.")
+            return False
+        if np.any(self.cell_types[mask] != EMPTY):
+            print("Grid2D::place_agents: Trying to add agents to non-empty cells.")
+            return False
+        self.cell_types[mask] = AGENT_CELL
+        for agent_id, coord in zip(agent_ids, coords):
+            self.agents_at[coord] = agent_id
+            self.agent_positions[agent_id] = coord
+        self.__cells = None
+        return True
+
     def add_agent(self, agent_id, coord):
         """
         Adds agent to 2D grid.
@@ -113,9 +333,11 @@ class Grid2D:
             print("Grid2D::add_agent: Position out of bounds.")
             return False
         x, y = coord
-        if self.cells[x][y] == EMPTY:
-            self.cells[x][y] = agent_id
+        if self.cell_types[x, y] == EMPTY:
+            self.cell_types[x, y] = AGENT_CELL
+            self.agents_at[(x, y)] = agent_id
             self.agent_positions[agent_id] = coord
+            self.__cells = None
             return True
 
         print("Grid2D::add_agent: Trying to add agent to non-empty cell.")
@@ -126,10 +348,11 @@ class Grid2D:
             print("Grid2D::remove_agent: Position out of bounds.")
             return False
         x, y = coord
-        if self.cells[x][y] > 0:
-            agent_id = self.cells[x][y]
-            self.cells[x][y] = EMPTY
+        if self.cell_types[x, y] == AGENT_CELL:
+            agent_id = self.agents_at.pop((x, y))
+            self.cell_types[x, y] = EMPTY
             del self.agent_positions[agent_id]
+            self.__cells = None
             return True
 
         print("Grid2D::remove_agent: Cell does not contain an agent.")
@@ -147,12 +370,76 @@ class Grid2D:
 
             # Only erase previous cell if you were the last to occupy it.
             # This is important in cases where one agent is closely following the next.
-            if self.cells[cur_x][cur_y] == agent_id:
-                self.cells[cur_x][cur_y] = EMPTY
-            self.cells[dest_x][dest_y] = agent_id
+            if self.agents_at.get((cur_x, cur_y), None) == agent_id:
+                self.cell_types[cur_x, cur_y] = EMPTY
+                del self.agents_at[(cur_x, cur_y)]
+            self.cell_types[dest_x, dest_y] = AGENT_CELL
+            self.agents_at[(dest_x, dest_y)] = agent_id
             self.agent_positions[agent_id] = dest_coord
+            self.__cells = None
             return True
 
+    def apply_changes(self, cell_values, agent_positions):
+        """
+        Overwrites cells and agent positions without performing any checks.
+        Used to replay recorded deltas on top of a snapshot.
+        :param cell_values: dict {key=coord (x,y tuple), value=cell (int)}
+        :param agent_positions: dict {key=agent_id (int), value=coord (x,y tuple)}
+        """
+        for coord, cell in cell_values.items():
+            x, y = coord
+            if (cell == GLOBAL_OBSTACLE) != (self.cell_types[x, y] == GLOBAL_OBSTACLE):
+                self.obstacle_version += 1
+            if cell > 0:
+                self.cell_types[x, y] = AGENT_CELL
+                self.agents_at[(x, y)] = cell
+            else:
+                self.cell_types[x, y] = cell
+                self.agents_at.pop((x, y), None)
+        self.agent_positions.update(agent_positions)
+        self.__cells = None
+
+    def write_cells(self, cell_values):
+        """
+        Overwrites cells, keeping agent positions consistent: an agent whose cell is overwritten
+        is removed from the grid. Cells are not checked for conflicts.
+        :param cell_values: dict {key=coord (x,y tuple), value=cell (int)}
+        """
+        for coord, cell in cell_values.items():
+            x, y = coord
+            if (cell == GLOBAL_OBSTACLE) != (self.cell_types[x, y] == GLOBAL_OBSTACLE):
+                self.obstacle_version += 1
+            previous_agent = self.agents_at.pop((x, y), None)
+            if previous_agent is not None and self.agent_positions.get(previous_agent, None) == (x, y):
+                del self.agent_positions[previous_agent]
+            if cell > 0:
+                self.cell_types[x, y] = AGENT_CELL
+                self.agents_at[(x, y)] = cell
+                self.agent_positions[cell] = (x, y)
+            else:
+                self.cell_types[x, y] = cell
+        self.__cells = None
+
+    def delta_to(self, other):
+        """
+        Finds the cells that differ from another grid of the same dimensions.
+        :param other: Grid2D instance.
+        :returns dict {key=coord (x,y tuple), value=cell (int)} with the cells of other that differ.
+        """
+        cells, other_cells = self.cells, other.cells
+        xs, ys = np.nonzero(cells != other_cells)
+        return dict(zip(zip(xs.tolist(), ys.tolist()), other_cells[xs, ys].tolist()))
+
+    def with_changes(self, cell_values):
+        """
+        Inverse of delta_to.
+        :param cell_values: dict {key=coord (x,y tuple), value=cell (int)}
+        :returns A copy of this grid with the given cells overwritten (see write_cells).
+        """
+        grid = copy.deepcopy(self)
+        grid.write_cells(cell_values)
+        return grid
+
     @staticmethod
     def is_obstacle(cell):
         return cell == GLOBAL_OBSTACLE or cell == LOCAL_OBSTACLE
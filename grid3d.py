@@ -1,24 +1,30 @@
-from typing import List
-import copy
+from typing import Union
 
-import grid2d
 from grid2d import Grid2D, GLOBAL_OBSTACLE
+from chunked_grid import new_grid
+from move_validation import validate_round
+from timeline import DeltaTimeline, MemmapTimeline, DEFAULT_KEYFRAME_INTERVAL
 from edict import Broadcaster
 from utils import *
 
 
 class Grid3D:
-    __steps = ...  # type: List[Grid2D]
+    __timeline = ...  # type: Union[DeltaTimeline, MemmapTimeline]
 
-    def __init__(self, w, h):
+    def __init__(self, w, h, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, history_file=None):
         """
         Constructs 3D grid (2D + time) containing one time step (initially).
-        Further time steps can be appended to __steps.
+        Further time steps are appended to __timeline, either in memory as deltas with a full
+        keyframe every keyframe_interval steps, or on disk if a history file is given.
         :param w: width of 2D grid
         :param h: height of 2D grid
+        :param keyframe_interval: Number of time steps between full grid snapshots (in memory only).
+        :param history_file: Optional path of a memory-mapped file holding every time step.
         """
-        self.__steps = []
-        self.__steps.append(grid2d.Grid2D(w, h))
+        if history_file is None:
+            self.__timeline = DeltaTimeline(new_grid(w, h), keyframe_interval)
+        else:
+            self.__timeline = MemmapTimeline(new_grid(w, h), history_file)
 
         self.__edit_lock = False
         self.__agent_positions = {}
@@ -30,7 +36,7 @@ class Grid3D:
         :param coord: Position to check.
         :returns True if within bounds. False otherwise.
         """
-        return self.__steps[0].within_bounds(coord) and t <= (len(self.__steps) - 1)
+        return self.__timeline.head().within_bounds(coord) and t <= self.__timeline.latest_time_step()
 
     @property
     def is_locked_for_edits(self):
@@ -45,10 +51,10 @@ class Grid3D:
         :param t: Time step.
         :returns Grid2D instance if found. False if not found.
         """
-        if t > len(self.__steps) or t < 0:
+        if t > self.__timeline.latest_time_step() or t < 0:
             print("Grid3D::grid_at: Time step {0} out of bounds.".format(t))
             return False
-        return self.__steps[t]
+        return self.__timeline.grid_at(t)
 
     def raw_grid_at(self, t):
         """
@@ -56,7 +62,17 @@ class Grid3D:
         :param t: Time step.
         :returns Numpy 2D array if found. False if not found.
         """
-        return self.grid_at(t).cells
+        if t > self.__timeline.latest_time_step() or t < 0:
+            print("Grid3D::raw_grid_at: Time step {0} out of bounds.".format(t))
+            return False
+        return self.__timeline.raw_grid_at(t)
+
+    def obstacle_version(self):
+        """
+        Global obstacles can only be edited before the simulation starts, so they are the same at every time step.
+        :returns Counter bumped whenever a global obstacle is added or removed (see Grid2D.obstacle_version).
+        """
+        return self.__timeline.head().obstacle_version
 
     def add_agent(self, agent_id, coord_at_t0):
         """
@@ -78,7 +94,7 @@ class Grid3D:
         if self.__agent_positions.get(agent_id, None):
             print("Grid3D::add_agent: Agent {0} already added.".format(agent_id))
             return False
-        success = self.__steps[time_step].add_agent(agent_id, coord_at_t0)
+        success = self.__timeline.head().add_agent(agent_id, coord_at_t0)
         if success:
             self.__agent_positions[agent_id] = {}
             self.__agent_positions[agent_id][time_step] = coord_at_t0
@@ -97,7 +113,7 @@ class Grid3D:
             return False
         if self.__agent_positions.get(agent_id, None):
             del self.__agent_positions[agent_id]
-            return self.__steps[0].remove_agent(coord_at_t0)
+            return self.__timeline.head().remove_agent(coord_at_t0)
 
         return False
 
@@ -130,10 +146,8 @@ class Grid3D:
         if not self.within_bounds(coord):
             print("Grid3D::add_obstacle: Coordinate {} is out of bounds.".format(coord))
             return False
-        for i in range(len(self.__steps)):
-            if self.__steps[i].add_obstacle(coord, type) is not True:
-                return False
-        return True
+        # Edits are locked once the simulation starts, so the timeline only holds time step 0.
+        return self.__timeline.head().add_obstacle(coord, type)
 
     def remove_obstacle(self, coord):
         if self.is_locked_for_edits:
@@ -142,11 +156,52 @@ class Grid3D:
         if not self.within_bounds(coord):
             print("Grid3D::remove_obstacle: Coordinate {} is out of bounds.".format(coord))
             return False
-        for i in range(len(self.__steps)):
-            if self.__steps[i].remove_obstacle(coord) is not True:
-                return False
+        return self.__timeline.head().remove_obstacle(coord)
 
-    def attempt_move(self, moves):
+    def add_obstacles(self, cells, type=GLOBAL_OBSTACLE):
+        """
+        Adds obstacles to several cells in one pass.
+        :param cells: Boolean mask or sequence of (x,y) tuples.
+        :param type: Type of obstacle (GLOBAL_OBSTACLE or LOCAL_OBSTACLE).
+        :returns True if successful.
+        """
+        if self.is_locked_for_edits:
+            print("Grid3D::add_obstacles: Cannot add obstacles while grid is locked for edits.")
+            return False
+        return self.__timeline.head().add_obstacles(cells, type)
+
+    def remove_obstacles(self, cells):
+        """
+        Removes every obstacle within the selected cells in one pass.
+        :param cells: Boolean mask or sequence of (x,y) tuples.
+        :returns Boolean mask of the cells that were cleared. None if unsuccessful.
+        """
+        if self.is_locked_for_edits:
+            print("Grid3D::remove_obstacles: Cannot remove obstacles while grid is locked for edits.")
+            return None
+        return self.__timeline.head().remove_obstacles(cells)
+
+    def place_agents(self, coords, agent_ids):
+        """
+        Adds several agents to the first time step of the grid in one pass.
+        :param coords: Sequence of (x,y) tuples at time step 0.
+        :param agent_ids: Sequence of agent ids, one per coordinate.
+        :returns True if successful.
+        """
+        time_step = 0
+        if self.is_locked_for_edits:
+            print("Grid3D::place_agents: Cannot add agents while grid is locked for edits.")
+            return False
+        if any(self.__agent_positions.get(agent_id, None) for agent_id in agent_ids):
+            print("Grid3D::place_agents: Some agents were already added.")
+            return False
+        success = self.__timeline.head().place_agents(coords, agent_ids)
+        if success:
+            for agent_id, (x, y) in zip(agent_ids, coords):
+                self.__agent_positions[int(agent_id)] = {time_step: (int(x), int(y))}
+        return success
+
+    def attempt_move(self, moves, reservations=None):
         """
         Attempts a move from latest simulated time step to next.
         A dict is passed as arguments containing agent_ids and coordinates for next time step.
@@ -154,6 +209,8 @@ class Grid3D:
         The feasibility of proposed moves is evaluated and checked against conflicts.
         :type moves: dict {key=agent_id (int), value=coord (int, int tuple)}.
         :param moves: Dict containing pairs of moves that constitute a round.
+        :param reservations: Optional ReservationTable used to report which conflicting moves enter cells
+        reserved by other agents.
         :returns True if moves accepted by world model. False if conflict is detected.
         """
         #########################################
@@ -169,38 +226,15 @@ class Grid3D:
             print("Grid3D::attempt_move: There are more moves than registered agents.")
             return False
         next_time_step = self.__latest_time_step + 1
-        crashing_agents = []
-        out_of_bounds = []
-        conflicts = set()
-        coords = list(moves.values())
-        if len(self.__steps) - 1 < next_time_step:
-            self.__steps.append(copy.deepcopy(self.__steps[self.__latest_time_step]))
-        else:
-            self.__steps[next_time_step] = copy.deepcopy(self.__steps[self.__latest_time_step])
-        for agent_id, coord in moves.items():
-            grid = self.raw_grid_at(next_time_step)
-            if not self.within_bounds(coord):
-                out_of_bounds.append(agent_id)
-                continue
-            x, y = coord
-            if Grid2D.is_obstacle(grid[x][y]):
-                crashing_agents.append(agent_id)
-            if coords.count(coord) > 1:
-                conflicts.add(agent_id)
-            if next_time_step > 2: #  No point checking for illegal swaps at beginning.
-                for other_agent_id, their_coord in moves.items():
-                    if agent_id == other_agent_id:
-                        continue
-                    current_step = next_time_step - 1
-                    # Formatting position to ((x,y), t)
-                    previous_pos = (self.__agent_positions[agent_id][current_step], current_step)
-                    their_previous_pos = (self.__agent_positions[other_agent_id][current_step], current_step)
-                    path_a = [previous_pos, (coord, next_time_step)]
-                    path_b = [their_previous_pos, (their_coord, next_time_step)]
-                    if illegal_position_swap(path_a, path_b, 2):
-                        conflicts.add(agent_id)
-                        conflicts.add(other_agent_id)
-
+        current_step = next_time_step - 1
+        agent_ids = list(moves.keys())
+        previous_coords = [self.__agent_positions[agent_id][current_step] for agent_id in agent_ids]
+        # Static cells never change between steps, so the latest step is checked for obstacles.
+        out_of_bounds, crashing_agents, conflicts = validate_round(self.grid_at(self.__latest_time_step).cell_types,
+                                                                   agent_ids, previous_coords,
+                                                                   list(moves.values()),
+                                                                   # No point checking for illegal swaps at beginning.
+                                                                   check_swaps=next_time_step > 2)
 
         if len(crashing_agents) > 0:
             print("Grid3D::attempt_move: Agent(s) {0} will collide with obstacles.".format(crashing_agents))
@@ -210,6 +244,11 @@ class Grid3D:
             return False
         if len(conflicts) > 0:
             print("Grid3D::attempt_move: Conflicts found between agents {0}.".format(conflicts))
+            if reservations is not None:
+                for agent_id in conflicts:
+                    if reservations.is_reserved(moves[agent_id], next_time_step, ignore_agent=agent_id):
+                        print("Grid3D::attempt_move: Agent {0} moves into {1}, reserved by another agent.".format(
+                            agent_id, moves[agent_id]))
             if 1 in conflicts:
                 Broadcaster().publish("/human_collision")
                 Broadcaster().publish("/new_event", "COLLISION")
@@ -219,8 +258,8 @@ class Grid3D:
         # Checks done. Moves are feasible, now move agents on next time step.#
         ######################################################################
 
+        self.__timeline.advance(moves)
         for agent_id, coord in moves.items():
-            self.__steps[next_time_step].move_agent(agent_id, coord)
             self.__agent_positions[agent_id][next_time_step] = coord
         self.__latest_time_step = next_time_step
         return True
@@ -229,6 +268,6 @@ class Grid3D:
         self.__edit_lock = True
 
     def simulation_size(self):
-        return len(self.__steps)
+        return len(self.__timeline)
 
 
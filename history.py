@@ -0,0 +1,98 @@
+import copy
+
+# History policies.
+FULL = 'full'  # Every recorded step is kept.
+RING = 'ring'  # Only the latest size time steps recorded are kept.
+KEYFRAME = 'keyframe'  # Every step is kept, as a keyframe or as a delta against the latest keyframe.
+OFF = 'off'  # Nothing is kept.
+HISTORY_POLICIES = (FULL, RING, KEYFRAME, OFF)
+
+DEFAULT_HISTORY_SIZE = 64
+DEFAULT_KEYFRAME_INTERVAL = 32
+
+
+def plan_snapshot(plan):
+    """
+    Plans are recorded as immutable tuples. Their (coord, time step) entries are already immutable,
+    so snapshots share them instead of copying.
+    """
+    if plan is None:
+        return None
+    return tuple(plan)
+
+
+class History:
+    def __init__(self, policy=FULL, size=DEFAULT_HISTORY_SIZE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 snapshot=copy.deepcopy, diff=None, patch=None):
+        """
+        Values recorded per time step under a bounded retention policy.
+        :param policy: One of HISTORY_POLICIES.
+        :param size: Number of steps kept by the RING policy.
+        :param keyframe_interval: Time steps between keyframes for the KEYFRAME policy.
+        :param snapshot: Function returning an independent copy of a value when it is recorded.
+        :param diff: Function (keyframe, value) -> delta used by the KEYFRAME policy.
+        :param patch: Function (keyframe, delta) -> new value, inverse of diff. Must not modify keyframe.
+        If diff or patch are missing, the KEYFRAME policy keeps every value as a keyframe.
+        """
+        if policy not in HISTORY_POLICIES:
+            print("History::__init__: Unknown policy {}. Keeping full history.".format(policy))
+            policy = FULL
+        self.policy = policy
+        self.__size = size
+        self.__keyframe_interval = keyframe_interval
+        self.__snapshot = snapshot
+        self.__diff = diff
+        self.__patch = patch
+        self.__entries = {}  # Time step -> snapshot.
+        self.__deltas = {}  # Time step -> (keyframe snapshot, delta). Only used by the KEYFRAME policy.
+        self.__latest_keyframe = None
+        self.__cache = (None, None)  # Last (time step, value) rebuilt from a delta.
+
+    def __len__(self):
+        return len(self.__entries) + len(self.__deltas)
+
+    def __contains__(self, time_step):
+        return time_step in self.__entries or time_step in self.__deltas
+
+    def record(self, time_step, value):
+        """
+        Keeps a snapshot of value for time_step, replacing any previous one.
+        """
+        if self.policy == OFF:
+            return
+        if self.__cache[0] == time_step:
+            self.__cache = (None, None)
+        if self.policy == KEYFRAME and self.__diff is not None and self.__patch is not None:
+            self.__record_keyframe_or_delta(time_step, value)
+            return
+        self.__entries[time_step] = self.__snapshot(value)
+        if self.policy == RING:
+            while len(self.__entries) > self.__size:
+                del self.__entries[min(self.__entries)]
+
+    def __record_keyframe_or_delta(self, time_step, value):
+        keyframe = self.__latest_keyframe
+        if keyframe is None or time_step <= keyframe or time_step - keyframe >= self.__keyframe_interval:
+            self.__deltas.pop(time_step, None)
+            self.__entries[time_step] = self.__snapshot(value)
+            if keyframe is None or time_step > keyframe:
+                self.__latest_keyframe = time_step
+            return
+        # Deltas keep their own reference to the keyframe, so re-recording it does not break them.
+        keyframe_value = self.__entries[keyframe]
+        self.__entries.pop(time_step, None)
+        self.__deltas[time_step] = (keyframe_value, self.__diff(keyframe_value, value))
+
+    def get(self, time_step, default=None):
+        """
+        :returns Snapshot recorded for time_step. default if it was not recorded or is no longer retained.
+        Snapshots are shared, so they must not be modified.
+        """
+        if time_step in self.__entries:
+            return self.__entries[time_step]
+        if time_step not in self.__deltas:
+            return default
+        if self.__cache[0] != time_step:
+            keyframe_value, delta = self.__deltas[time_step]
+            self.__cache = (time_step, self.__patch(keyframe_value, delta))
+        return self.__cache[1]
@@ -0,0 +1,120 @@
+import heapq
+
+from grid2d import neighbour_table
+from static_layer import UNREACHABLE
+
+INFINITY = float('inf')
+
+
+class IncrementalPlanner:
+    def __init__(self, static_layer, goal, world_model):
+        """
+        Distances from every cell to a goal on an agent's belief model, kept up to date across time steps
+        with Lifelong Planning A* (LPA*) run backwards from the goal. The search starts from the distance
+        field of the static layer, so only cells around believed obstacles are ever searched, and each
+        change of beliefs only repairs the distances it affects.
+        The distance field and neighbour table are shared by every planner on the same static layer.
+        Only the cells whose distance differs from the distance field are stored per planner.
+        Distances are exact for the belief model, so they are a consistent heuristic for
+        Agent.find_path_3D_search (waiting and conceding only make paths longer).
+        :param static_layer: StaticLayer the belief model is built on.
+        :param goal: (x,y) tuple.
+        :param world_model: OverlayGrid2D built on static_layer with the current beliefs of the agent.
+        """
+        self.static_layer = static_layer
+        self.goal = goal
+        w, h = static_layer.shape
+        self.__height = h
+        self.__goal = goal[0] * h + goal[1]
+        self.__indptr, self.__indices = (memoryview(table) for table in neighbour_table(w, h, 'von_neumann'))
+        self.__static_distances = memoryview(static_layer.distance_field(goal).ravel())
+        self.__static_open = memoryview(static_layer.open_cells)
+        self.__blocked = set()  # Cells the belief model blocks besides global obstacles.
+        self.__g = {}  # Cell -> distance, where it differs from the static distance field.
+        self.__rhs = {}  # Cell -> one-step lookahead distance, where it differs from the static distance field.
+        self.__queue = []  # Heap of (key, cell). Entries whose key is out of date are skipped.
+        self.expansions = 0
+        self.update({coord: cell for coord, cell in world_model.cell_types.overlay_items() if cell < 0})
+
+    def __static_distance(self, i):
+        d = self.__static_distances[i]
+        return INFINITY if d == UNREACHABLE else d
+
+    def __is_open(self, i):
+        return self.__static_open[i] and i not in self.__blocked
+
+    def __neighbours(self, i):
+        return self.__indices[self.__indptr[i]:self.__indptr[i + 1]]
+
+    def distance(self, i):
+        """
+        :param i: Cell linearised as x * height + y.
+        :returns Number of moves from the cell to the goal. None if the goal cannot be reached.
+        """
+        d = self.__g.get(i, None)
+        if d is None:
+            d = self.__static_distance(i)
+        return None if d == INFINITY else d
+
+    def update(self, changes):
+        """
+        Repairs the distances after cells of the belief model change.
+        :param changes: dict {key=coord (x,y tuple), value=cell (int)} with the new cell values.
+        :returns Set of coords whose distance changed.
+        """
+        for (x, y), cell in changes.items():
+            i = x * self.__height + y
+            if not self.__static_open[i]:
+                continue
+            if cell < 0:
+                if i in self.__blocked:
+                    continue
+                self.__blocked.add(i)
+            elif i in self.__blocked:
+                self.__blocked.remove(i)
+            else:
+                continue
+            self.__update_cell(i)
+            for n in self.__neighbours(i):
+                self.__update_cell(n)
+        return self.__compute_distances()
+
+    def __get(self, values, i):
+        d = values.get(i, None)
+        return self.__static_distance(i) if d is None else d
+
+    def __set(self, values, i, d):
+        if d == self.__static_distance(i):
+            values.pop(i, None)
+        else:
+            values[i] = d
+
+    def __update_cell(self, i):
+        if i != self.__goal:
+            rhs = INFINITY
+            if self.__is_open(i):
+                for n in self.__neighbours(i):
+                    if self.__is_open(n):
+                        rhs = min(rhs, self.__get(self.__g, n) + 1)
+            self.__set(self.__rhs, i, rhs)
+        g, rhs = self.__get(self.__g, i), self.__get(self.__rhs, i)
+        if g != rhs:
+            heapq.heappush(self.__queue, (min(g, rhs), i))
+
+    def __compute_distances(self):
+        previous = {}  # Cell -> distance before this update.
+        while len(self.__queue) > 0:
+            key, i = heapq.heappop(self.__queue)
+            g, rhs = self.__get(self.__g, i), self.__get(self.__rhs, i)
+            if g == rhs or key != min(g, rhs):
+                continue  # Already consistent, or queued again with another key.
+            self.expansions += 1
+            previous.setdefault(i, g)
+            if g > rhs:
+                self.__set(self.__g, i, rhs)
+            else:
+                self.__set(self.__g, i, INFINITY)
+                self.__update_cell(i)
+            for n in self.__neighbours(i):
+                self.__update_cell(n)
+        return {divmod(i, self.__height) for i, distance in previous.items() if self.__get(self.__g, i) != distance}
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def validate_round(cells, agent_ids, previous_coords, proposed_coords, check_swaps=True):
+    """
+    Validates a whole round of moves at once.
+    Every agent is linearised to a cell id (x * height + y) so that vertex conflicts can be
+    found by counting the agents that target each cell, and swap conflicts by joining each move edge
+    against the reversed edges of all other agents. Work only depends on the number of agents.
+    :param cells: Numpy 2D array (or chunked layer) with the cells or cell classes of the latest time step.
+    Obstacles are negative.
+    :param agent_ids: Sequence of agent ids (int).
+    :param previous_coords: Sequence of (x,y) tuples with the current position of each agent.
+    :param proposed_coords: Sequence of (x,y) tuples with the proposed position of each agent.
+    :param check_swaps: Whether agents swapping positions should be reported as conflicts.
+    :returns Tuple (out_of_bounds, crashing_agents, conflicts). The first two are lists of agent ids
+    in the order they were given, the last is a set of agent ids.
+    """
+    width, height = cells.shape
+    ids = np.asarray(agent_ids, dtype=np.int64)
+    if len(ids) == 0:
+        return [], [], set()
+    previous = np.asarray(previous_coords, dtype=np.int64).reshape(-1, 2)
+    proposed = np.asarray(proposed_coords, dtype=np.int64).reshape(-1, 2)
+
+    x, y = proposed[:, 0], proposed[:, 1]
+    in_bounds = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    # Out of bounds moves are mapped to cell 0 and masked out afterwards.
+    proposed_ids = np.where(in_bounds, x * height + y, 0)
+    previous_ids = previous[:, 0] * height + previous[:, 1]
+
+    crashing = np.zeros(len(ids), dtype=bool)
+    crashing[in_bounds] = cells[x[in_bounds], y[in_bounds]] < 0
+
+    targets, occupants = np.unique(proposed_ids[in_bounds], return_counts=True)
+    conflicting = in_bounds & np.isin(proposed_ids, targets[occupants > 1])
+
+    if check_swaps:
+        num_cells = width * height
+        moving = in_bounds & (previous_ids != proposed_ids)
+        edges = previous_ids[moving] * num_cells + proposed_ids[moving]
+        reversed_edges = proposed_ids[moving] * num_cells + previous_ids[moving]
+        swapping = np.zeros(len(ids), dtype=bool)
+        swapping[moving] = np.isin(reversed_edges, edges)
+        conflicting |= swapping
+
+    out_of_bounds = ids[~in_bounds].tolist()
+    crashing_agents = ids[crashing].tolist()
+    conflicts = set(ids[conflicting].tolist())
+    return out_of_bounds, crashing_agents, conflicts
@@ -0,0 +1,144 @@
+import numpy as np
+
+from grid2d import AGENT_CELL
+
+# Marks window cells that fall outside the map.
+OUT_OF_BOUNDS = np.iinfo(np.int32).min
+
+
+def batch_visibility_windows(cells, positions, radius):
+    """
+    Computes the visibility windows of several agents sharing the same radius in one call.
+    Only the cells inside the windows are read, and window cells outside the map are OUT_OF_BOUNDS,
+    so that every window has shape (2 * radius + 1, 2 * radius + 1).
+    :param cells: Numpy 2D array of cell values, or any layer with a shape that supports [xs, ys]
+    integer array indexing (e.g. chunked_grid.ChunkedLayer).
+    :param positions: Sequence of (x,y) tuples.
+    :param radius: Visibility radius.
+    :returns Tuple (origins, windows): a list of (x,y) coordinates of each window[0][0] (which may be
+    negative) and a numpy array of shape (len(positions), 2 * radius + 1, 2 * radius + 1).
+    """
+    side = 2 * radius + 1
+    windows = np.full((len(positions), side, side), OUT_OF_BOUNDS, dtype=np.int32)
+    if len(positions) == 0:
+        return [], windows
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+    offsets = np.arange(-radius, radius + 1)
+    xs = np.broadcast_to(positions[:, 0, np.newaxis, np.newaxis] + offsets[:, np.newaxis], windows.shape)
+    ys = np.broadcast_to(positions[:, 1, np.newaxis, np.newaxis] + offsets, windows.shape)
+    width, height = cells.shape
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    windows[inside] = cells[xs[inside], ys[inside]]
+    origins = [(int(x) - radius, int(y) - radius) for x, y in positions]
+    return origins, windows
+
+
+def grid_visibility_windows(grid, positions, radius):
+    """
+    Same as batch_visibility_windows, but reads a Grid2D (or subclass) without building its cells view:
+    windows are gathered from its layer of cell classes, and agent ids are filled in from agents_at.
+    :param grid: Grid2D instance.
+    :param positions: Sequence of (x,y) tuples.
+    :param radius: Visibility radius.
+    :returns Tuple (origins, windows) (see batch_visibility_windows).
+    """
+    origins, windows = batch_visibility_windows(grid.cell_types, positions, radius)
+    for i, x, y in np.argwhere(windows == AGENT_CELL).tolist():
+        windows[i, x, y] = grid.agents_at[(origins[i][0] + x, origins[i][1] + y)]
+    return origins, windows
+
+
+def window_cells(origin, window, mask=None):
+    """
+    Lists the cells of a visibility window, skipping cells outside the map.
+    :param origin: (x,y) coordinate of window[0][0].
+    :param window: Numpy 2D array of cell values.
+    :param mask: Optional boolean array selecting which cells of the window to list.
+    :returns Tuple (xs, ys, values) of numpy 1D arrays with map coordinates and cell values.
+    """
+    selected = window != OUT_OF_BOUNDS
+    if mask is not None:
+        selected &= mask
+    xs, ys = np.nonzero(selected)
+    return xs + origin[0], ys + origin[1], window[xs, ys]
+
+
+def window_changes(previous_origin, previous_window, origin, window):
+    """
+    Finds the cells of a window that were not part of the previous window or whose value changed.
+    :param previous_origin: (x,y) coordinate of previous_window[0][0].
+    :param previous_window: Numpy 2D array of cell values of the previous observation.
+    :param origin: (x,y) coordinate of window[0][0].
+    :param window: Numpy 2D array of cell values of the current observation.
+    :returns Numpy 2D boolean array with the shape of window, True where the cell changed.
+    """
+    changed = np.ones(window.shape, dtype=bool)
+    dx = previous_origin[0] - origin[0]
+    dy = previous_origin[1] - origin[1]
+    # Overlap of both windows, in current window coordinates.
+    x0, x1 = max(dx, 0), min(dx + previous_window.shape[0], window.shape[0])
+    y0, y1 = max(dy, 0), min(dy + previous_window.shape[1], window.shape[1])
+    if x0 < x1 and y0 < y1:
+        changed[x0:x1, y0:y1] = window[x0:x1, y0:y1] != previous_window[x0 - dx:x1 - dx, y0 - dy:y1 - dy]
+    return changed
+
+
+# Multipliers that map the first octant onto each of the eight octants.
+OCTANT_TRANSFORMS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+                     (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+def shadowcast(opaque, pos, radius):
+    """
+    Computes the cells visible from pos using recursive shadowcasting.
+    Visibility is bounded by the same square (Chebyshev) radius as visibility windows.
+    Opaque cells are visible themselves but hide the cells behind them.
+    :param opaque: Numpy 2D boolean array, True where a cell blocks sight.
+    :param pos: (x,y) tuple of the viewer.
+    :param radius: Visibility radius.
+    :returns Numpy 2D boolean array of shape (2 * radius + 1, 2 * radius + 1), aligned with the
+    visibility window of pos (window[radius][radius] is pos).
+    """
+    visible = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=bool)
+    visible[radius, radius] = True
+    for transform in OCTANT_TRANSFORMS:
+        _cast_octant(opaque, pos, radius, 1, 1.0, 0.0, transform, visible)
+    return visible
+
+
+def _cast_octant(opaque, pos, radius, row, start, end, transform, visible):
+    """
+    Scans one octant row by row, recursing on the gaps left between obstacles.
+    """
+    if start < end:
+        return
+    width, height = opaque.shape
+    xx, xy, yx, yy = transform
+    new_start = start
+    for j in range(row, radius + 1):
+        dx, dy = -j - 1, -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            x, y = pos[0] + dx * xx + dy * xy, pos[1] + dx * yx + dy * yy
+            left_slope, right_slope = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+            if start < right_slope:
+                continue
+            if end > left_slope:
+                break
+            inside = 0 <= x < width and 0 <= y < height
+            if inside:
+                visible[x - pos[0] + radius, y - pos[1] + radius] = True
+            is_opaque = not inside or opaque[x, y]
+            if blocked:
+                if is_opaque:
+                    new_start = right_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif is_opaque and j < radius:
+                blocked = True
+                _cast_octant(opaque, pos, radius, j + 1, start, left_slope, transform, visible)
+                new_start = right_slope
+        if blocked:
+            break
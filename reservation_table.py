@@ -0,0 +1,99 @@
+from utils import *
+
+
+class ReservationTable:
+    def __init__(self):
+        """
+        Space-time reservation table built from the latest plans of all agents.
+        Cells are reserved per ((x,y), t) and moves per (origin, destination, t), where t is
+        the time step at which the move starts. Agents are assumed to stay at the last
+        position of their plan indefinitely.
+        """
+        self.__cells = {}
+        self.__edges = {}
+        self.__parked = {}
+        self.__reserved_keys = {}
+
+    def update_plan(self, agent_id, plan):
+        """
+        Replaces the reservations of an agent with those of its new plan.
+        :param agent_id: Agent's unique identifier.
+        :param plan: List of ((x,y), t) tuples. None or empty to only drop reservations.
+        """
+        self.remove_agent(agent_id)
+        if plan is None or len(plan) == 0:
+            return
+        cell_keys = []
+        edge_keys = []
+        for i in range(len(plan)):
+            step = plan[i]
+            self.__cells.setdefault(step, set()).add(agent_id)
+            cell_keys.append(step)
+            if i + 1 < len(plan) and plan[i + 1][POS] != step[POS]:
+                edge = (step[POS], plan[i + 1][POS], step[TIME_STEP])
+                self.__edges.setdefault(edge, set()).add(agent_id)
+                edge_keys.append(edge)
+        last_pos, last_time_step = plan[-1]
+        self.__parked.setdefault(last_pos, {})[agent_id] = last_time_step
+        self.__reserved_keys[agent_id] = (cell_keys, edge_keys, last_pos)
+
+    def remove_agent(self, agent_id):
+        """
+        Drops every reservation held by an agent.
+        :param agent_id: Agent's unique identifier.
+        """
+        reserved = self.__reserved_keys.pop(agent_id, None)
+        if reserved is None:
+            return
+        cell_keys, edge_keys, last_pos = reserved
+        for table, keys in ((self.__cells, cell_keys), (self.__edges, edge_keys)):
+            for key in keys:
+                holders = table.get(key, None)
+                if holders is None:
+                    continue
+                holders.discard(agent_id)
+                if len(holders) == 0:
+                    del table[key]
+        parked = self.__parked.get(last_pos, None)
+        if parked is not None:
+            parked.pop(agent_id, None)
+            if len(parked) == 0:
+                del self.__parked[last_pos]
+
+    def occupants_at(self, coord, t):
+        """
+        Returns the agents that plan to be at a cell at a given time step.
+        :param coord: (x,y) tuple.
+        :param t: Time step.
+        :returns Set of agent ids (possibly empty).
+        """
+        occupants = set(self.__cells.get((coord, t), ()))
+        for agent_id, arrival_time_step in self.__parked.get(coord, {}).items():
+            if arrival_time_step <= t:
+                occupants.add(agent_id)
+        return occupants
+
+    def is_reserved(self, coord, t, ignore_agent=None, by_agent=None):
+        """
+        :param ignore_agent: Agent whose reservations are not considered.
+        :param by_agent: If given, only the reservations of this agent are considered.
+        :returns True if by_agent (or, if not given, any agent other than ignore_agent) plans to be at coord at time step t.
+        """
+        if by_agent is not None:
+            if by_agent == ignore_agent:
+                return False
+            if by_agent in self.__cells.get((coord, t), ()):
+                return True
+            arrival_time_step = self.__parked.get(coord, {}).get(by_agent, None)
+            return arrival_time_step is not None and arrival_time_step <= t
+        return len(self.occupants_at(coord, t) - {ignore_agent}) > 0
+
+    def swapping_agents(self, origin, destination, t):
+        """
+        Returns the agents that plan to traverse the given move in the opposite direction.
+        :param origin: (x,y) tuple where the move starts.
+        :param destination: (x,y) tuple where the move ends.
+        :param t: Time step at which the move starts.
+        :returns Set of agent ids (possibly empty).
+        """
+        return set(self.__edges.get((destination, origin, t), ()))
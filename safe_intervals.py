@@ -0,0 +1,183 @@
+import heapq
+
+from grid2d import neighbour_table
+from utils import POS, TIME_STEP
+
+INFINITY = float('inf')
+
+
+def safe_intervals(unsafe_time_steps):
+    """
+    Splits the timeline of a cell into the intervals between the time steps it is occupied.
+    :param unsafe_time_steps: Iterable of time steps.
+    :returns Sorted list of (first, last) time step tuples (inclusive, possibly infinite).
+    """
+    intervals = []
+    start = -INFINITY
+    for time_step in sorted(set(unsafe_time_steps)):
+        if time_step > start:
+            intervals.append((start, time_step - 1))
+        start = time_step + 1
+    intervals.append((start, INFINITY))
+    return intervals
+
+
+class ConcededPlans:
+    def __init__(self, plans):
+        """
+        Estimated plans of the agents conceded to, compiled once per search into hashed lookups.
+        An agent must not enter a cell at a time step a conceded agent plans to be there, nor swap
+        cells with a conceded agent (who is assumed to stay at the end of its plan).
+        :param plans: Iterable of estimated plans (lists of (coord, time step) tuples).
+        """
+        self.__steps = set()  # Every (coord, time step) of every plan.
+        self.__occupied = {}  # Coord -> time steps some conceded agent is there.
+        self.__plans = []  # (steps, time step -> coord, last time step) per plan.
+        for plan in plans:
+            positions = {}
+            for pos, time_step in plan:
+                self.__occupied.setdefault(pos, []).append(time_step)
+                positions.setdefault(time_step, pos)
+            if len(plan) > 0:
+                self.__plans.append((set(plan), positions, plan[-1][TIME_STEP]))
+                self.__steps.update(plan)
+        self.__intervals = {}
+
+    def occupied(self, step):
+        """
+        :param step: (coord, time step) tuple.
+        :returns True if some conceded agent plans to be at coord at that time step.
+        """
+        return step in self.__steps
+
+    def intervals(self, coord):
+        """
+        :returns Safe intervals of coord (see safe_intervals).
+        """
+        intervals = self.__intervals.get(coord, None)
+        if intervals is None:
+            intervals = safe_intervals(self.__occupied.get(coord, ()))
+            self.__intervals[coord] = intervals
+        return intervals
+
+    def last_occupied(self, coord):
+        """
+        :returns Last time step some conceded agent plans to be at coord, 0 if none does.
+        """
+        return max(self.__occupied.get(coord, ()), default=0)
+
+    def swaps(self, coord, neighbour, time_step):
+        """
+        :returns True if moving from coord to neighbour at time_step swaps cells with a conceded agent.
+        """
+        for steps, positions, last_time_step in self.__plans:
+            if (coord, time_step + 1) in steps and positions.get(min(time_step, last_time_step), None) == neighbour:
+                return True
+        return False
+
+
+def find_path_safe_intervals(world_model, origin, goal, conceded_plans, distance_to_goal, deadline):
+    """
+    Safe Interval Path Planning (SIPP): A* over (cell, safe interval) states instead of (cell, time step)
+    states, so waiting for conceded agents to pass costs one expansion instead of one per time step.
+    States are reached at the earliest time step possible, which is optimal since agents can wait
+    anywhere within a safe interval.
+    :param world_model: Grid2D (or subclass) with the beliefs of the agent.
+    :param origin: ((x,y), time step) tuple representing start.
+    :param goal: (x,y) tuple representing destination. It is only reached once no conceded agent plans to visit it.
+    :param conceded_plans: ConcededPlans instance.
+    :param distance_to_goal: Function cell -> admissible estimate of the moves to goal, None if unreachable.
+    Cells are linearised as x * height + y, as in the shared neighbour_table iterated by the search.
+    :param deadline: Last time step the goal may be reached at.
+    :returns Tuple (path, number of expanded states, True if the deadline cut the search). The path is a list of
+    (coord, time step) tuples with one entry per time step (waits included), or None if goal is unreachable.
+    """
+    origin_pos, origin_time_step = origin
+    h = world_model.height
+    indptr, indices = (memoryview(table) for table in neighbour_table(world_model.width, h, 'von_neumann'))
+    open_cells, blocked = world_model.passable_cells()
+    open_cells = memoryview(open_cells)
+    origin_intervals = conceded_plans.intervals(origin_pos)
+    origin_interval = next((i for i, (first, last) in enumerate(origin_intervals)
+                            if first <= origin_time_step <= last), None)
+    if origin_interval is None:
+        # Planned to be occupied at the start, which is only checked from then on.
+        following = [interval for interval in origin_intervals if interval[0] == origin_time_step + 1]
+        origin_intervals = [(origin_time_step, following[0][1] if following else origin_time_step)]
+        origin_interval = -1
+    start = (origin_pos, origin_interval)
+    arrivals = {start: origin_time_step}
+    came_from = {start: None}
+    goal_wait_until = conceded_plans.last_occupied(goal) + 1
+    timed_out = False
+    expansions = 0
+
+    estimate = distance_to_goal(origin_pos[0] * h + origin_pos[1])
+    to_visit = []
+    if estimate is not None:
+        to_visit.append((origin_time_step + estimate, origin_time_step, origin_pos, origin_interval))
+    while len(to_visit) > 0:
+        _, time_step, pos, interval = heapq.heappop(to_visit)
+        state = (pos, interval)
+        if time_step > arrivals[state]:
+            continue  # Reached earlier through another path.
+        expansions += 1
+        last = origin_intervals[interval][1] if state == start else conceded_plans.intervals(pos)[interval][1]
+
+        if pos == goal and last == INFINITY:  # Found goal!
+            finish = max(time_step, goal_wait_until)
+            if finish <= deadline:
+                return _reconstruct_path(came_from, arrivals, state, finish), expansions, timed_out
+            timed_out = True
+            continue
+
+        i = pos[0] * h + pos[1]
+        for n in indices[indptr[i]:indptr[i + 1]]:
+            if not open_cells[n] or n in blocked:
+                continue
+            estimate = distance_to_goal(n)
+            if estimate is None:
+                continue
+            neighbour = divmod(n, h)
+            for i, (neighbour_first, neighbour_last) in enumerate(conceded_plans.intervals(neighbour)):
+                if neighbour_last < time_step + 1:
+                    continue
+                if neighbour_first > last + 1:
+                    break
+                # Earliest departure that reaches the interval without swapping cells with a conceded agent.
+                departure = max(time_step, neighbour_first - 1)
+                while departure <= min(last, neighbour_last - 1) and \
+                        conceded_plans.swaps(pos, neighbour, departure):
+                    departure += 1
+                if departure > min(last, neighbour_last - 1):
+                    continue
+                arrival = departure + 1
+                if arrival + estimate > deadline:
+                    timed_out = True
+                    continue
+                neighbouring_state = (neighbour, i)
+                if arrival < arrivals.get(neighbouring_state, INFINITY):
+                    arrivals[neighbouring_state] = arrival
+                    came_from[neighbouring_state] = state
+                    heapq.heappush(to_visit, (arrival + estimate, arrival, neighbour, i))
+    return None, expansions, timed_out
+
+
+def _reconstruct_path(came_from, arrivals, state, finish):
+    """
+    Expands (cell, interval) states back into one (coord, time step) entry per time step.
+    """
+    states = []
+    while state is not None:
+        states.append(state)
+        state = came_from[state]
+    states.reverse()
+    path = []
+    for state, next_state in zip(states, states[1:]):
+        # Waits until the departure, one step before arriving at the next state.
+        for time_step in range(arrivals[state], arrivals[next_state]):
+            path.append((state[POS], time_step))
+    goal_state = states[-1]
+    for time_step in range(arrivals[goal_state], finish + 1):
+        path.append((goal_state[POS], time_step))
+    return path
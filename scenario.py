@@ -0,0 +1,164 @@
+import numpy as np
+
+from grid2d import AGENT_CELL
+
+SCENARIO_EXTENSION = ".npz"
+
+
+class Scenario:
+    def __init__(self, width, height):
+        """
+        Everything needed to start a simulation: map, agents, goals, culture, mode and agent properties.
+        Agents are kept in the order a row-major scan of the map finds them.
+        :param width: width of 2D grid
+        :param height: height of 2D grid
+        """
+        self.width = width
+        self.height = height
+        self.cell_types = np.zeros((width, height), dtype=np.int8)
+        self.agent_ids = np.zeros(0, dtype=np.int32)
+        self.agent_coords = np.zeros((0, 2), dtype=np.int32)
+        self.goals = {}
+        self.culture = None
+        self.mode = None
+        self.properties = []  # List of (agent_id, property, value string) tuples.
+
+    def set_cells(self, cells):
+        """
+        Fills cell classes and agents from an array of cell values (as returned by Grid2D.cells).
+        :param cells: Numpy 2D array of cell values.
+        """
+        cells = np.asarray(cells)
+        self.cell_types = np.where(cells > 0, AGENT_CELL, cells).astype(np.int8)
+        self.agent_coords = np.argwhere(cells > 0).astype(np.int32)
+        self.agent_ids = cells[cells > 0].astype(np.int32)
+
+
+def is_scenario_file(filename):
+    return filename.endswith(SCENARIO_EXTENSION)
+
+
+def save_scenario(filename, scenario):
+    """
+    Saves a scenario in the binary (compressed npz) format.
+    :param filename: Destination path. SCENARIO_EXTENSION is appended if missing.
+    :param scenario: Scenario instance.
+    """
+    goal_ids = np.array(list(scenario.goals.keys()), dtype=np.int32)
+    goal_coords = np.array(list(scenario.goals.values()), dtype=np.int32).reshape(-1, 2)
+    np.savez_compressed(filename,
+                        cell_types=scenario.cell_types,
+                        agent_ids=scenario.agent_ids,
+                        agent_coords=scenario.agent_coords,
+                        goal_ids=goal_ids,
+                        goal_coords=goal_coords,
+                        culture=np.array(scenario.culture or ''),
+                        mode=np.array(scenario.mode or ''),
+                        property_agent_ids=np.array([p[0] for p in scenario.properties], dtype=np.int32),
+                        property_names=np.array([p[1] for p in scenario.properties], dtype=str),
+                        property_values=np.array([str(p[2]) for p in scenario.properties], dtype=str))
+
+
+def load_scenario(filename):
+    """
+    Loads a scenario saved with save_scenario.
+    :param filename: Path of the npz file.
+    :returns Scenario instance.
+    """
+    with np.load(filename) as data:
+        width, height = data['cell_types'].shape
+        scenario = Scenario(width, height)
+        scenario.cell_types = data['cell_types']
+        scenario.agent_ids = data['agent_ids']
+        scenario.agent_coords = data['agent_coords']
+        scenario.goals = {int(agent_id): (int(x), int(y))
+                          for agent_id, (x, y) in zip(data['goal_ids'], data['goal_coords'])}
+        scenario.culture = str(data['culture']) or None
+        scenario.mode = str(data['mode']) or None
+        scenario.properties = [(int(agent_id), str(name), str(value)) for agent_id, name, value in
+                               zip(data['property_agent_ids'], data['property_names'], data['property_values'])]
+    return scenario
+
+
+def parse_grd(filename):
+    """
+    Reads a text .grd file in a single pass.
+    :param filename: Path of the .grd file.
+    :returns Scenario instance. None if the file is ill-formed.
+    """
+    with open(filename, "r") as file:
+        lines = file.read().splitlines()
+    width, height = (int(value) for value in lines[0].split())
+    rows = [line.split() for line in lines[1:width + 1]]
+    if len(rows) != width or any(len(row) != height for row in rows):
+        print("scenario::parse_grd: Ill-formed file! Grid might be corrupted.")
+        return None
+    scenario = Scenario(width, height)
+    scenario.set_cells(np.array(rows, dtype=np.int32))
+
+    i = width + 1
+    section = None
+    while i < len(lines):
+        words = lines[i].split()
+        i += 1
+        if len(words) == 0:
+            continue
+        if words[0] in ("GOALS", "CULTURE", "MODE", "PROPERTIES", "END"):
+            section = words[0]
+            continue
+        if section == "GOALS":
+            agent_id, goal_x, goal_y = words
+            scenario.goals[int(agent_id)] = (int(goal_x), int(goal_y))
+        elif section == "CULTURE":
+            scenario.culture = words[0]
+        elif section == "MODE":
+            scenario.mode = words[0]
+        elif section == "PROPERTIES":
+            # Format: agent_id {property string} VALUE {value string}
+            separator_index = words.index("VALUE")
+            scenario.properties.append((int(words[0]), " ".join(words[1:separator_index]),
+                                        " ".join(words[separator_index + 1:])))
+    return scenario
+
+
+def read_scenario(filename):
+    """
+    Reads a scenario from either format, depending on the file extension.
+    :returns Scenario instance. None if unsuccessful.
+    """
+    if is_scenario_file(filename):
+        return load_scenario(filename)
+    return parse_grd(filename)
+
+
+def convert_grd(grd_filename, scenario_filename=None):
+    """
+    Converts a text .grd file into the binary scenario format.
+    :param grd_filename: Path of the .grd file.
+    :param scenario_filename: Destination path. Defaults to the same name with SCENARIO_EXTENSION.
+    :returns Destination path if successful. None otherwise.
+    """
+    scenario = parse_grd(grd_filename)
+    if scenario is None:
+        return None
+    if scenario_filename is None:
+        scenario_filename = grd_filename.rsplit(".", 1)[0] + SCENARIO_EXTENSION
+    save_scenario(scenario_filename, scenario)
+    return scenario_filename
+
+
+def scenario_dimensions(filename):
+    """
+    :returns (width, height) of a scenario file in either format. Ill-formed text files may return another length.
+    """
+    if is_scenario_file(filename):
+        with np.load(filename) as data:
+            return data['cell_types'].shape
+    with open(filename, "r") as file:
+        return tuple(int(value) for value in file.readline().split())
+
+
+if __name__ == "__main__":
+    import sys
+    for grd_filename in sys.argv[1:]:
+        print("{} -> {}".format(grd_filename, convert_grd(grd_filename)))
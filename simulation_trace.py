@@ -0,0 +1,170 @@
+import ast
+import os
+import struct
+import time
+import numpy as np
+
+TRACE_MAGIC = b"BBTRACE2"
+DEFAULT_BUFFER_SIZE = 1 << 16
+DEFAULT_FLUSH_INTERVAL = 10  # Time steps between flushes.
+
+# Record kinds.
+MOVES = 0
+POSITIONS = 1
+PLAN_HEADS = 2
+LOCUTION = 3
+EVENT = 4
+RUN_START = 5  # Written whenever a writer opens the file, so appended runs can be told apart.
+
+RECORD_HEADER = struct.Struct("<BII")  # Kind, time step, payload length.
+AGENT_COORD = struct.Struct("<Iii")  # Agent id, x, y.
+AGENT_STEP = struct.Struct("<Iiii")  # Agent id, x, y, time step.
+LOCUTION_ENTRY = struct.Struct("<IIBBI")  # Sender id, receiver id, act type, content type, content length.
+RUN_START_ENTRY = struct.Struct("<d")  # Wall-clock time the run started at (seconds since the epoch).
+
+
+def plain_value(value):
+    """
+    Converts numpy scalars (also inside lists, tuples and dicts) to Python values, so repr can be read back
+    with ast.literal_eval.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return type(value)(plain_value(v) for v in value)
+    if isinstance(value, dict):
+        return {plain_value(k): plain_value(v) for k, v in value.items()}
+    return value
+
+
+def complete_length(file):
+    """
+    Finds where the last complete record of a trace ends, skipping over payloads without reading them.
+    :param file: Trace file opened for binary reading, positioned after TRACE_MAGIC.
+    :returns Offset of the end of the last complete record.
+    """
+    end = file.seek(0, 2)
+    offset = len(TRACE_MAGIC)
+    while True:
+        file.seek(offset)
+        header = file.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return offset
+        length = RECORD_HEADER.unpack(header)[2]
+        if offset + RECORD_HEADER.size + length > end:
+            return offset
+        offset += RECORD_HEADER.size + length
+
+
+class TraceWriter:
+    def __init__(self, filename, flush_interval=DEFAULT_FLUSH_INTERVAL, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Streams a compact binary trace of a simulation to an append-only file.
+        Records are buffered in memory and flushed every flush_interval time steps.
+        Every writer starts with a RUN_START record, so several runs can share a file.
+        :param filename: Path of the trace file. Records are appended if it already exists, after dropping
+        a record cut short by an interrupted run.
+        :param flush_interval: Number of completed time steps between flushes.
+        :param buffer_size: Size of the write buffer in bytes.
+        """
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, "r+b") as file:
+                if file.read(len(TRACE_MAGIC)) == TRACE_MAGIC:
+                    file.truncate(complete_length(file))
+                else:
+                    print("TraceWriter::__init__: {} is not a trace file. Appending anyway.".format(filename))
+        self.__file = open(filename, "ab", buffering=buffer_size)
+        if self.__file.tell() == 0:
+            self.__file.write(TRACE_MAGIC)
+        self.__write(RUN_START, 0, RUN_START_ENTRY.pack(time.time()))
+        self.__flush_interval = flush_interval
+        self.__steps_since_flush = 0
+
+    def __write(self, kind, time_step, payload):
+        self.__file.write(RECORD_HEADER.pack(kind, time_step, len(payload)))
+        self.__file.write(payload)
+
+    def moves(self, time_step, moves):
+        """
+        :param moves: dict {key=agent_id (int), value=coord (int, int tuple)} proposed at time_step.
+        """
+        self.__write(MOVES, time_step, b"".join(AGENT_COORD.pack(a, x, y) for a, (x, y) in moves.items()))
+
+    def positions(self, time_step, positions):
+        """
+        :param positions: dict {key=agent_id (int), value=coord (int, int tuple)} committed at time_step.
+        """
+        self.__write(POSITIONS, time_step, b"".join(AGENT_COORD.pack(a, x, y) for a, (x, y) in positions.items()))
+
+    def plan_heads(self, time_step, plan_heads):
+        """
+        :param plan_heads: dict {key=agent_id (int), value=((x,y), t)} with the next step each agent plans
+        after time_step, as held once agents perceived time_step (before any replan).
+        """
+        self.__write(PLAN_HEADS, time_step,
+                     b"".join(AGENT_STEP.pack(a, x, y, t) for a, ((x, y), t) in plan_heads.items()))
+
+    def locution(self, time_step, sender_id, receiver_id, locution):
+        """
+        Records a locution with its content (e.g. waypoints, conflict or arguments), so the dialogue can be replayed.
+        """
+        content = repr(plain_value(locution.content())).encode("utf-8")
+        self.__write(LOCUTION, time_step, LOCUTION_ENTRY.pack(sender_id, receiver_id,
+                                                              locution.act_type().value,
+                                                              locution.content_type().value,
+                                                              len(content)) + content)
+
+    def event(self, time_step, event):
+        self.__write(EVENT, time_step, str(event).encode("utf-8"))
+
+    def end_step(self):
+        """
+        Marks the end of a time step, flushing the buffer periodically.
+        """
+        self.__steps_since_flush += 1
+        if self.__steps_since_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.__file.flush()
+        self.__steps_since_flush = 0
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.close()
+
+
+def read_trace(filename):
+    """
+    Reads a trace written by TraceWriter.
+    :param filename: Path of the trace file.
+    :returns Generator of (kind, time_step, content) tuples. Content is a dict {agent_id: coord} for
+    MOVES and POSITIONS, {agent_id: ((x,y), t)} for PLAN_HEADS, a (sender_id, receiver_id, act type value,
+    content type value, content dict) tuple for LOCUTION, a string for EVENT and the start time of the run
+    for RUN_START.
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            print("simulation_trace::read_trace: {} is not a trace file.".format(filename))
+            return
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return  # End of file (or a record cut short by an interrupted run).
+            kind, time_step, length = RECORD_HEADER.unpack(header)
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            if kind in (MOVES, POSITIONS):
+                content = {a: (x, y) for a, x, y in AGENT_COORD.iter_unpack(payload)}
+            elif kind == PLAN_HEADS:
+                content = {a: ((x, y), t) for a, x, y, t in AGENT_STEP.iter_unpack(payload)}
+            elif kind == LOCUTION:
+                sender_id, receiver_id, act_type, content_type, length = LOCUTION_ENTRY.unpack_from(payload)
+                locution_content = payload[LOCUTION_ENTRY.size:LOCUTION_ENTRY.size + length].decode("utf-8")
+                content = (sender_id, receiver_id, act_type, content_type, ast.literal_eval(locution_content))
+            elif kind == RUN_START:
+                content = RUN_START_ENTRY.unpack(payload)[0]
+            else:
+                content = payload.decode("utf-8")
+            yield kind, time_step, content
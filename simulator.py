@@ -3,8 +3,14 @@ import time
 import os
 from pydoc import locate
 from grid3d import Grid3D
-from grid2d import Grid2D, EMPTY, GLOBAL_OBSTACLE
+from grid2d import Grid2D, EMPTY, GLOBAL_OBSTACLE, LOCAL_OBSTACLE
 from agent import Agent
+from agent_registry import AgentRegistry, ACTIVE, AGENT_STATUSES
+from reservation_table import ReservationTable
+from scenario import Scenario, read_scenario, save_scenario, is_scenario_file
+from simulation_trace import TraceWriter
+from perception import grid_visibility_windows, window_changes, OUT_OF_BOUNDS
+from static_layer import StaticLayer
 from utils import *
 from edict import Broadcaster
 from cultures.easy import EasyCulture
@@ -15,15 +21,28 @@ from argument import *
 
 
 COMMUNICATION = True
+OCCLUDED_VISIBILITY = False  # If True, global obstacles block the sight of agents.
+
+CULTURES = {'E': EasyCulture, 'M': MediumCulture, 'H': HardCulture}
+CULTURE_CODES = {culture_class: code for code, culture_class in CULTURES.items()}
 
 
 #FIXME: Agents need to be able to re-inform their new paths after rerouting.
 
 class Simulator:
-    def __init__(self, w, h, filename, player_id):
-        self.__world_model = Grid3D(w, h)
+    def __init__(self, w, h, filename, player_id, history_file=None, trace_file=None):
+        self.__world_model = Grid3D(w, h, history_file=history_file)
+        self.__trace = TraceWriter(trace_file) if trace_file else None
+        self.__traced_plan_heads = -1  # Last time step whose plan heads were traced.
         self.__agents = {}
-        self.__obstacles = []
+        self.__registry = AgentRegistry()
+        self.__reservations = ReservationTable()
+        self.__obstacles = set()
+        self.__global_obstacle_mask = None
+        self.__static_layer = None
+        self.__static_layer_version = None  # Obstacle version of the world model the static layer was checked at.
+        self.__last_update_layer = None  # Static layer sent to agents by the last update_agents call.
+        self.__observations = {}  # Agent id -> (agent, origin, window) of its last perception.
         self.__width = w
         self.__height = h
         self.__current_time_step = 0
@@ -38,7 +57,6 @@ class Simulator:
 
         if filename:
             self.load_grid(filename)
-            self.load_culture(filename)
 
         os.mkdir("results/{}/".format(player_id))
 
@@ -53,9 +71,9 @@ class Simulator:
         human_agent = self.agent(HUMAN)
         cpu_agent = self.agent(agent_id)
         for property in human_agent.culture_properties():
-            human_property_value = human_agent.__dict__.get(property, None)
+            human_property_value = human_agent[property]
             human_text = "<font color=\"red\">" + str(human_property_value) + "</font>"
-            cpu_property_value = cpu_agent.__dict__.get(property, None)
+            cpu_property_value = cpu_agent[property]
             cpu_text = "<font color=\"green\">" + str(cpu_property_value) + "</font>"
             line = str(property) + ":\t" + human_text + " vs. " + cpu_text + "<br>"
             text += line
@@ -67,6 +85,8 @@ class Simulator:
 
     def add_event(self, event):
         self.__events.append((event, time.time()))
+        if self.__trace is not None:
+            self.__trace.event(self.__current_time_step, event)
 
     def increment_collision_counter(self):
         self.__num_collisions += 1
@@ -77,13 +97,7 @@ class Simulator:
         human_score = self.agent(HUMAN).score
         time_penalty = self.agent(HUMAN).time_penalty
         file = open("results/{}/results.txt".format(self.__player_id), "w")
-        culture = '?'
-        if type(self.__culture) == EasyCulture:
-            culture = 'E'
-        elif type(self.__culture) == MediumCulture:
-            culture = 'M'
-        elif type(self.__culture) == HardCulture:
-            culture = 'H'
+        culture = CULTURE_CODES.get(type(self.__culture), '?')
         file.write("Player id: " + str(self.__player_id) + "\n")
         file.write("Culture: " + culture + "\n")
         file.write("Mode: " + 'X\n' if Agent.EXPLAINABLE else "Mode: " + 'N\n')
@@ -98,6 +112,12 @@ class Simulator:
             event_time = event[1]
             file.write("{0} : {1}\n".format(event_text, event_time))
         file.close()
+        self.close_trace()
+
+    def close_trace(self):
+        if self.__trace is not None:
+            self.__trace.close()
+            self.__trace = None
 
     def print_log(self, log):
         print(log)
@@ -105,11 +125,25 @@ class Simulator:
     def agent(self, agent_id):
         return self.__agents.get(agent_id, None)
 
+    def registry(self):
+        return self.__registry
+
+    def reservations(self):
+        return self.__reservations
+
+    def plan_changed(self, agent_id, plan):
+        """
+        Called by agents whenever their plan changes, to keep the reservation table in sync.
+        :param agent_id: Agent's unique identifier.
+        :param plan: New plan of the agent. List of ((x,y), t) tuples or None.
+        """
+        self.__reservations.update_plan(agent_id, plan)
+
     def is_cell_empty(self, coord, t = 0):
-        return self.__world_model.raw_grid_at(t)[coord[0]][coord[1]] == EMPTY
+        return self.__world_model.grid_at(t).cell(coord) == EMPTY
 
     def cell_at(self, coord, t = 0):
-        return self.__world_model.raw_grid_at(t)[coord[0]][coord[1]]
+        return self.__world_model.grid_at(t).cell(coord)
 
     def random_coord(self):
         """
@@ -120,6 +154,15 @@ class Simulator:
         ry = np.random.randint(0, self.__height)
         return rx, ry
 
+    def random_empty_coords(self, num_coords):
+        """
+        Convenience method that picks distinct random empty cells at time step 0.
+        :param num_coords: Number of cells to pick.
+        :return: Numpy array of shape (num_coords, 2).
+        """
+        empty_coords = np.argwhere(self.__world_model.raw_grid_at(0) == EMPTY)
+        return empty_coords[np.random.choice(len(empty_coords), num_coords, replace=False)]
+
     def create_random_obstacles(self, num_obstacles):
         """
         Convenience method that populates the world model with random obstacles.
@@ -130,13 +173,7 @@ class Simulator:
             print("Simulator::create_random_obstacles: There are no sufficient empty cells.")
             return
 
-        obstacles_placed = 0
-        while obstacles_placed < num_obstacles:  # TODO: Improve algorithm.
-            coord = self.random_coord()
-            if self.is_cell_empty(coord):
-                self.__obstacles.append(coord)
-                self.__world_model.add_obstacle(coord)
-                obstacles_placed += 1
+        self.add_obstacles(self.random_empty_coords(num_obstacles))
         print(self.__world_model.raw_grid_at(0).transpose())
 
     def create_random_agents(self, num_agents):
@@ -149,12 +186,7 @@ class Simulator:
             print("Simulator::create_random_agents: There are no sufficient empty cells.")
             return
 
-        agents_placed = 0
-        while agents_placed < num_agents:  # TODO: Improve algorithm.
-            coord = self.random_coord()
-            if self.is_cell_empty(coord):
-                self.add_agent(coord)
-                agents_placed += 1
+        self.place_agents(self.random_empty_coords(num_agents))
         print(self.__world_model.raw_grid_at(0).transpose())
 
     def assign_random_goals(self):
@@ -178,48 +210,159 @@ class Simulator:
         """
         This method updates all agents with what is currently visible (for each)
         at a specific time step t.
+        Only agents that are active, moved, see something change or have pending events perceive
+        (and replan). The rest are parked at their goal or waiting, and just let time pass.
         """
 
-        for agent in self.__agents.values():
-            current_pos = self.__world_model.find_agent(agent.agent_id(), self.__current_time_step)
+        grid = self.__world_model.grid_at(t)
+        if grid is False:
+            return
+        static_layer = self.static_layer()
+        new_layer = static_layer is not self.__last_update_layer
+        self.__last_update_layer = static_layer
+        agents = list(self.__agents.values())
+        positions = [self.__world_model.find_agent(agent.agent_id(), self.__current_time_step) for agent in agents]
+        windows = self.visibility_windows(grid, agents, positions)
+
+        for agent, current_pos, (origin, window) in zip(agents, positions, windows):
             agent.set_current_pos(current_pos)
             if self.__game_over == False and agent.is_human() and current_pos == agent.goal():
                 Broadcaster().publish("/game_over")
                 self.__game_over = True
-            vr = agent.visibility_radius()
-            visible_cells = {}
-            for i in range(0, self.__width):
-                for j in range(0, self.__height):
-                    x, y = current_pos
-                    cell_value = self.__world_model.raw_grid_at(t)[i][j]
-                    if in_visibility_range(vr, current_pos, (i, j)):
-                        visible_cells[(i, j)] = cell_value
-                    else:
-                        # Global obstacles are copied anyway.
-                        if cell_value == GLOBAL_OBSTACLE:
-                            visible_cells[(i, j)] = cell_value
-
-            agent.update_world_knowledge(visible_cells, t)
-
+            field_of_view = static_layer.visibility_mask(current_pos, agent.visibility_radius())
+            window = np.where(field_of_view, window, OUT_OF_BOUNDS)
+            observation = self.__observations.get(agent.agent_id(), None)
+            changed = None
+            if observation is not None and observation[0] is agent and observation[2].shape == window.shape:
+                changed = window_changes(observation[1], observation[2], origin, window)
+            self.__observations[agent.agent_id()] = (agent, origin, window)
+            if new_layer or changed is None or changed.any() or agent.status() == ACTIVE or \
+                    agent.has_pending_events() or origin != observation[1]:
+                agent.perceive(origin, window, t, static_layer, changed)
+            else:
+                agent.idle(t)
+        if self.__trace is not None and t == self.__current_time_step and t > self.__traced_plan_heads:
+            self.trace_plan_heads(t)
+
+    def activity(self):
+        """
+        :returns dict {key=agent status (see agent_registry.AGENT_STATUSES), value=number of agents}.
+        """
+        registry = self.__registry
+        status = registry.status[registry.rows(registry.agent_ids())]
+        counts = np.bincount(status, minlength=len(AGENT_STATUSES))
+        return {agent_status: int(counts[agent_status]) for agent_status in AGENT_STATUSES}
 
+    def visibility_windows(self, grid, agents, positions):
+        """
+        Computes the visibility window of every agent, batching agents that share a visibility radius.
+        :param grid: Grid2D instance to read the windows from.
+        :param agents: List of agents.
+        :param positions: List of (x,y) tuples with the position of each agent.
+        :returns List of (origin, window) tuples in the same order as agents.
+        """
+        by_radius = {}
+        for i, agent in enumerate(agents):
+            by_radius.setdefault(agent.visibility_radius(), []).append(i)
+        windows = [None] * len(agents)
+        for radius, indices in by_radius.items():
+            origins, radius_windows = grid_visibility_windows(grid, [positions[i] for i in indices], radius)
+            for i, origin, window in zip(indices, origins, radius_windows):
+                windows[i] = (origin, window)
+        return windows
+
+    def static_layer(self):
+        """
+        Global obstacles are visible to every agent regardless of range, so they are kept in a single
+        read-only layer shared by all belief models. It is only replaced when the global obstacles change,
+        which is only checked when the obstacle version of the world model changes.
+        :returns StaticLayer instance.
+        """
+        version = self.__world_model.obstacle_version()
+        if self.__static_layer is not None and version == self.__static_layer_version:
+            return self.__static_layer
+        self.__static_layer_version = version
+        grid = self.__world_model.grid_at(self.__current_time_step)
+        mask = np.asarray(grid.cell_types) == GLOBAL_OBSTACLE
+        if self.__static_layer is None or not np.array_equal(mask, self.__global_obstacle_mask):
+            self.__global_obstacle_mask = mask
+            self.__static_layer = StaticLayer(mask, occlusion=OCCLUDED_VISIBILITY)
+        return self.__static_layer
 
     def add_obstacle(self, coord, type=GLOBAL_OBSTACLE):
         success = self.__world_model.add_obstacle(coord, type)
         if success:
-            self.__obstacles.append(coord)
+            self.__obstacles.add(coord)
+
+    def add_obstacles(self, cells, type=GLOBAL_OBSTACLE):
+        """
+        Adds obstacles to several cells in one pass.
+        :param cells: Boolean mask or sequence of (x,y) tuples (e.g. from grid2d.rectangle_mask).
+        :returns True if successful.
+        """
+        mask = self.__world_model.grid_at(0).as_mask(cells)
+        if mask is None:
+            return False
+        success = self.__world_model.add_obstacles(mask, type)
+        if success:
+            self.__obstacles.update(map(tuple, np.argwhere(mask).tolist()))
+        return success
+
+    def remove_obstacles(self, cells):
+        """
+        Removes every obstacle within the selected cells in one pass.
+        :param cells: Boolean mask or sequence of (x,y) tuples.
+        :returns True if successful.
+        """
+        cleared = self.__world_model.remove_obstacles(cells)
+        if cleared is None:
+            return False
+        self.__obstacles.difference_update(map(tuple, np.argwhere(cleared).tolist()))
+        return True
+
+    def place_agents(self, coords, agent_ids=None):
+        """
+        Adds several agents in one pass.
+        Agents with given ids are added as in add_agent. If no ids are given, free ids are
+        allocated and agents get random culture values as in add_any_agent.
+        :param coords: Sequence of (x,y) tuples.
+        :param agent_ids: Optional sequence of agent ids, one per coordinate.
+        :returns True if successful.
+        """
+        coords = [(int(x), int(y)) for x, y in coords]
+        random_values = agent_ids is None
+        if random_values:
+            agent_ids = self.free_agent_ids(len(coords))
+        if any(agent_id in self.__agents for agent_id in agent_ids):
+            print("Simulator::place_agents: Agent already exists!")
+            return False
+        success = self.__world_model.place_agents(coords, agent_ids)
+        if not success:
+            return False
+        for agent_id in agent_ids:
+            agent = Agent(agent_id, (self.__width, self.__height), self)
+            self.__agents[agent_id] = agent
+            if random_values:
+                agent.set_culture(self.__culture)
+                self.__culture.initialise_random_values(agent)
+            elif agent_id == HUMAN:  # By convention, agent 1 is always going to be the human player.
+                agent.set_human_control(True)
+        return True
+
+    def free_agent_ids(self, num_ids):
+        """
+        :param num_ids: Number of ids to allocate.
+        :returns List of the lowest agent ids not in use.
+        """
+        return self.__registry.free_ids(num_ids)
 
     def add_any_agent(self, coord):
-        match = True
-        for id in range(1, 1000):
-            match = any(agent.agent_id() == id for agent in self.__agents.values())
-            if match is False:
-                break
-        if match is False:
-            success = self.__world_model.add_agent(id, coord)
-            if success:
-                self.__agents[id] = Agent(id, (self.__width, self.__height), self)
-                self.__agents[id].set_culture(self.__culture)
-                self.__culture.initialise_random_values(self.__agents[id])
+        id = self.free_agent_ids(1)[0]
+        success = self.__world_model.add_agent(id, coord)
+        if success:
+            self.__agents[id] = Agent(id, (self.__width, self.__height), self)
+            self.__agents[id].set_culture(self.__culture)
+            self.__culture.initialise_random_values(self.__agents[id])
 
     def add_agent(self, coord, agent_id=None):
         if agent_id is None:
@@ -246,9 +389,10 @@ class Simulator:
         if self.cell_at(coord) > 0:
             agent_id = self.cell_at(coord)
             self.__world_model.remove_agent(agent_id, coord)
-            for agent in self.__agents.values():
-                if agent.agent_id() == agent_id:
-                    del self.__agents[agent_id]
+            self.__reservations.remove_agent(agent_id)
+            self.__observations.pop(agent_id, None)
+            if self.__agents.pop(agent_id, None) is not None:
+                self.__registry.unregister(agent_id)
         self.update_agents(self.__current_time_step)
 
     def agents(self):
@@ -274,6 +418,8 @@ class Simulator:
         t = self.__current_time_step
         Broadcaster().publish("/log/raw", "\n*** END OF STEP {} ***\n".format(t))
         self.__world_model.lock_for_edits()
+        for agent in self.__agents.values():
+            agent.update_plan()  # Pending replans run once, before any move is collected.
         moves = {}
         still_agents = 0
         for agent in self.__agents.values():
@@ -290,7 +436,9 @@ class Simulator:
         moves_str = "Proposed moves: {}".format(moves)
         # Broadcaster().publish("/log/raw", moves_str)
         print(moves_str)
-        result = self.__world_model.attempt_move(moves)
+        result = self.__world_model.attempt_move(moves, self.__reservations)
+        if self.__trace is not None:
+            self.trace_step(t, moves, result)
         if result:
             self.__current_time_step += 1
             # self.update_agents(self.__current_time_step)
@@ -300,101 +448,121 @@ class Simulator:
                 self.__start_time = time.time()
         return result
 
+    def trace_step(self, t, moves, accepted):
+        """
+        Streams the proposed moves of time step t and, if accepted, the committed positions.
+        """
+        self.__trace.moves(t, moves)
+        if not accepted:
+            return
+        self.__trace.positions(t + 1, moves)
+        self.__trace.end_step()
+
+    def trace_plan_heads(self, t):
+        """
+        Streams the next step each agent plans after time step t, once agents have perceived it.
+        Plans are read as held by the agents, so tracing never triggers a replan. A plan head that differs
+        from the move proposed at t means the agent replanned before moving.
+        """
+        self.__traced_plan_heads = t
+        plan_heads = {}
+        for agent in self.__agents.values():
+            plan_head = agent.plan_head(t)
+            if plan_head is not None:
+                plan_heads[agent.agent_id()] = plan_head
+        self.__trace.plan_heads(t, plan_heads)
+
     def send_locution(self, source_id, destination_id, locution):
+        if self.__trace is not None:
+            self.__trace.locution(self.__current_time_step, source_id, destination_id, locution)
         self.__agents[destination_id].receive_locution(source_id, locution)
 
     def load_grid(self, filename):
+        """
+        Loads a scenario from a text .grd file or a binary scenario file.
+        Either format is read in a single pass.
+        """
         print("Loading grid!")
-        file = open(filename, "r")
-        grid = self.__world_model.grid_at(0)
-        file.readline()  # Skip dimensions line.
-        for i in range(grid.width):
-            values = file.readline().split()
-            if len(values) != grid.height:
-                print("Simulator::load_grid: Ill-formed file! Grid might be corrupted.")
-                return
-            for j in range(len(values)):
-                cell_value = int(values[j])
-                if cell_value > 0:
-                    print("Adding agent {}".format(cell_value))
-                    self.add_agent((i,j), cell_value)
-                elif cell_value < 0:
-                    self.add_obstacle((i,j), cell_value) # TODO: Fix signature mismatch of add_obstacle and add_agent
-                grid.cells[i][j] = values[j] # TODO: Load properly (use add_* methods)
-        goals = file.readline().split()[0]
-        if goals == "GOALS":
-            goal = file.readline()
-            while goal.split()[0] != "CULTURE":
-                agent_id, goal_x, goal_y = goal.split()
-                self.assign_goal(int(agent_id), (int(goal_x), int(goal_y)))
-                goal = file.readline()
-        file.close()
+        scenario = read_scenario(filename)
+        if scenario is None:
+            return
+        self.apply_scenario(scenario)
 
-    def load_culture(self, filename):
-        print("Loading culture!")
-        file = open(filename, "r")
-        line = file.readline()
-        while line:
-            if line.split()[0] == "CULTURE":
-                culture = file.readline().split()[0]
-                if culture == 'E':
-                    self.__culture = EasyCulture()
-                elif culture == 'M':
-                    self.__culture = MediumCulture()
-                elif culture == 'H':
-                    self.__culture = HardCulture()
-                else:
-                    print("Simulator::load_culture: No culture chosen!")
-                    return
-                for agent in self.__agents.values():
-                    agent.set_culture(self.__culture)
-            elif line.split()[0] == "MODE":
-                mode = file.readline().split()[0]
-                if mode == 'X':
-                    Agent.EXPLAINABLE = True
-                elif mode == 'N':
-                    Agent.EXPLAINABLE = False
-                else:
-                    print("Simulator::load_culture: No mode defined!")
-                    return
-            elif line.split()[0] == "PROPERTIES":
-                property_tuple = file.readline().split()
-                while property_tuple[0] != "END":
-                    # Format: agent_id {property string} VALUE {value string}
-                    agent_id = int(property_tuple[0])
-                    separator_index = [i for i, text in enumerate(property_tuple) if text == "VALUE"][0]
-                    property = " ".join(property_tuple[1:separator_index])
-                    value_string = " ".join(property_tuple[separator_index+1:])
-                    if value_string.isdigit():
-                        value = int(value_string)
-                    else:
-                        value = value_string
-                    self.__agents[agent_id].assign_property_value(property, value)
-                    property_tuple = file.readline().split()
-
-            line = file.readline()
+    def apply_scenario(self, scenario):
+        """
+        Populates the world model from a Scenario with bulk operations.
+        """
+        if (scenario.width, scenario.height) != (self.__width, self.__height):
+            print("Simulator::apply_scenario: Scenario dimensions do not match the grid.")
+            return
+        for obstacle_type in (GLOBAL_OBSTACLE, LOCAL_OBSTACLE):
+            mask = scenario.cell_types == obstacle_type
+            if mask.any():
+                self.add_obstacles(mask, obstacle_type)
+        self.place_agents(scenario.agent_coords, scenario.agent_ids.tolist())
+        for agent_id, goal in scenario.goals.items():
+            self.assign_goal(agent_id, goal)
+        self.apply_culture(scenario)
+
+    def apply_culture(self, scenario):
+        """
+        Sets culture, mode and agent properties from a Scenario.
+        """
+        if scenario.culture is not None:
+            culture_class = CULTURES.get(scenario.culture, None)
+            if culture_class is None:
+                print("Simulator::apply_culture: No culture chosen!")
+                return
+            self.__culture = culture_class()
+            for agent in self.__agents.values():
+                agent.set_culture(self.__culture)
+        if scenario.mode is not None:
+            if scenario.mode == 'X':
+                Agent.EXPLAINABLE = True
+            elif scenario.mode == 'N':
+                Agent.EXPLAINABLE = False
+            else:
+                print("Simulator::apply_culture: No mode defined!")
+                return
+        for agent_id, property, value_string in scenario.properties:
+            if value_string.isdigit():
+                value = int(value_string)
+            else:
+                value = value_string
+            self.__agents[agent_id].assign_property_value(property, value)
+
+    def scenario(self):
+        """
+        :returns Scenario instance describing the current map, goals, culture, mode and properties.
+        """
+        scenario = Scenario(self.__width, self.__height)
+        scenario.set_cells(self.__world_model.raw_grid_at(0))
+        for agent in self.__agents.values():
+            if agent.goal() is not None:
+                scenario.goals[agent.agent_id()] = agent.goal()
+        scenario.culture = CULTURE_CODES.get(type(self.__culture), None)
+        scenario.mode = 'X' if Agent.EXPLAINABLE else 'N'
+        for agent in self.__agents.values():
+            for property in agent.culture_properties() or ():
+                scenario.properties.append((agent.agent_id(), property, agent[property]))
+        return scenario
 
     def save_grid(self, filename):
+        if is_scenario_file(filename):
+            save_scenario(filename, self.scenario())
+            return
         file = open(filename, "w")
-        grid = self.__world_model.grid_at(0)
-        dim_x = grid.width
-        dim_y = grid.height
+        grid = self.__world_model.raw_grid_at(0)
+        dim_x, dim_y = grid.shape
         file.write("{} {}\n".format(dim_x, dim_y))
-        for i in range(grid.width):
-            for j in range(grid.height):
-                file.write("{} ".format(grid.cells[i][j]))
-            file.write("\n")
+        file.write("".join(" ".join(str(cell) for cell in row) + " \n" for row in grid.tolist()))
         file.write("GOALS\n")
         for agent in self.__agents.values():
             goal_x, goal_y = agent.goal()
             file.write("{} {} {}\n".format(agent.agent_id(), goal_x, goal_y))
         file.write("CULTURE\n")
-        if type(self.__culture) == EasyCulture:
-            file.write("E\n")
-        elif type(self.__culture) == MediumCulture:
-            file.write("M\n")
-        elif type(self.__culture) == HardCulture:
-            file.write("H\n")
+        if type(self.__culture) in CULTURE_CODES:
+            file.write(CULTURE_CODES[type(self.__culture)] + "\n")
         file.write("MODE\n")
         if Agent.EXPLAINABLE:
             file.write("X\n")
@@ -405,7 +573,7 @@ class Simulator:
             agent_id = agent.agent_id()
             properties = agent.culture_properties()
             for property in properties:
-                value = agent.__dict__.get(property, None)
+                value = agent[property]
                 file.write("{} {} VALUE {}\n".format(agent_id, property, value))
         file.write("END")
         file.close()
@@ -0,0 +1,226 @@
+import copy
+import functools
+import weakref
+import numpy as np
+
+from grid2d import Grid2D
+from chunked_grid import new_grid
+from perception import shadowcast
+
+UNREACHABLE = -1  # Distance of cells from which a goal cannot be reached (see StaticLayer.distance_field).
+
+
+@functools.lru_cache(maxsize=None)
+def open_field_of_view(radius):
+    """
+    :returns Read-only mask of a field of view without occlusion (every cell is visible).
+    """
+    mask = np.ones((2 * radius + 1, 2 * radius + 1), dtype=bool)
+    mask.flags.writeable = False
+    return mask
+
+
+class StaticLayer:
+    def __init__(self, obstacle_mask, occlusion=False):
+        """
+        Read-only layer with the global obstacles of the map, shared by the belief models of every agent.
+        Belief models built on it (OverlayLayer) hold a reference until they are garbage collected.
+        It also caches the field of view of every (position, radius) pair and the distance field of every
+        goal, since they only depend on the global obstacles. A new layer (with empty caches) is built
+        whenever they change.
+        :param obstacle_mask: Numpy 2D boolean array, True where there is a global obstacle.
+        :param occlusion: If True, global obstacles block sight (see perception.shadowcast).
+        Otherwise every cell within the visibility radius is visible.
+        """
+        obstacle_mask = np.asarray(obstacle_mask, dtype=bool)
+        self.shape = obstacle_mask.shape
+        self.occlusion = occlusion
+        self.grid = new_grid(*self.shape)
+        self.grid.add_obstacles(obstacle_mask)
+        self.__opaque = obstacle_mask.copy() if occlusion else None
+        self.__fields_of_view = {}  # (pos, radius) -> bits of the visibility mask (np.packbits).
+        self.__distance_fields = {}  # Goal -> distance field.
+        self.open_cells = ~obstacle_mask.ravel()  # Read-only, one entry per cell linearised as x * h + y.
+        self.open_cells.flags.writeable = False
+        self.__references = 0
+
+    def visibility_mask(self, pos, radius):
+        """
+        Field of view of a viewer at pos, aligned with its visibility window
+        (see perception.batch_visibility_windows). Cells outside the map may be marked visible.
+        :param pos: (x,y) tuple of the viewer.
+        :param radius: Visibility radius.
+        :returns Numpy 2D boolean array of shape (2 * radius + 1, 2 * radius + 1). Do not modify it.
+        """
+        side = 2 * radius + 1
+        if not self.occlusion:
+            return open_field_of_view(radius)
+        key = (tuple(pos), radius)
+        bits = self.__fields_of_view.get(key, None)
+        if bits is None:
+            bits = np.packbits(shadowcast(self.__opaque, key[0], radius))
+            self.__fields_of_view[key] = bits
+        return np.unpackbits(bits, count=side * side).astype(bool).reshape(side, side)
+
+    def distance_field(self, goal):
+        """
+        Number of von Neumann moves from every cell to goal around global obstacles, computed by a
+        breadth-first search backwards from goal. Other obstacles and agents can only make paths longer,
+        so it is an admissible (and consistent) heuristic for searches on belief models built on this layer.
+        :param goal: (x,y) tuple.
+        :returns Read-only numpy 2D array of the smallest signed integer type that fits the distances.
+        Cells that cannot reach goal hold UNREACHABLE.
+        """
+        goal = (int(goal[0]), int(goal[1]))
+        field = self.__distance_fields.get(goal, None)
+        if field is None:
+            field = self.__search_backwards(goal)
+            field.flags.writeable = False
+            self.__distance_fields[goal] = field
+        return field
+
+    def __search_backwards(self, goal):
+        w, h = self.shape
+        distances = np.full(w * h, UNREACHABLE, dtype=np.min_scalar_type(-w * h))
+        start = goal[0] * h + goal[1]
+        if self.open_cells[start]:
+            # Breadth-first search one whole frontier at a time, so the cost follows the frontiers and not the map.
+            distances[start] = 0
+            frontier = np.array([start])
+            first_seen = np.empty(w * h, dtype=np.int64)  # Position of each cell among the candidates that found it.
+            distance = 0
+            while len(frontier) > 0:
+                distance += 1
+                xs, ys = np.divmod(frontier, h)
+                candidates = np.concatenate((frontier[xs > 0] - h, frontier[xs < w - 1] + h,
+                                             frontier[ys > 0] - 1, frontier[ys < h - 1] + 1))
+                candidates = candidates[self.open_cells[candidates] & (distances[candidates] == UNREACHABLE)]
+                # Cells found from several frontier cells are kept once (where the last write landed).
+                order = np.arange(len(candidates))
+                first_seen[candidates] = order
+                frontier = candidates[first_seen[candidates] == order]
+                distances[frontier] = distance
+        return distances.reshape(w, h)
+
+    def __deepcopy__(self, memo):
+        return self  # Immutable.
+
+    def acquire(self):
+        self.__references += 1
+        return self
+
+    def release(self):
+        self.__references -= 1
+
+    def references(self):
+        """
+        :returns Number of belief layers currently built on this layer.
+        """
+        return self.__references
+
+
+class OverlayLayer:
+    def __init__(self, static_layer):
+        """
+        Layer of cell classes made of a shared StaticLayer plus a small private overlay.
+        Only cells that differ from the static layer are stored. Supports the same indexing as
+        the layers of Grid2D ([x, y], integer arrays and boolean masks) and np.asarray.
+        :param static_layer: StaticLayer instance.
+        """
+        self.static_layer = static_layer.acquire()
+        self.shape = static_layer.shape
+        self.dtype = np.dtype(np.int8)
+        self.__static = static_layer.grid.cell_types
+        self.__overlay = {}
+        weakref.finalize(self, static_layer.release)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __deepcopy__(self, memo):
+        layer = OverlayLayer(self.static_layer)
+        layer.__overlay = copy.copy(self.__overlay)
+        return layer
+
+    def overlay_size(self):
+        return len(self.__overlay)
+
+    def overlay_items(self):
+        """
+        :returns Iterable of (coord, cell class) pairs for the cells that differ from the static layer.
+        """
+        return self.__overlay.items()
+
+    def value(self, x, y):
+        """
+        Fast scalar read.
+        :returns Cell class at (x, y) as an int.
+        """
+        value = self.__overlay.get((x, y), None)
+        if value is None:
+            return int(self.__static[x, y])
+        return int(value)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and np.isscalar(key[0]) and np.isscalar(key[1]):
+            value = self.__overlay.get(key, None)
+            if value is None:
+                return self.__static[key]
+            return value
+        return np.asarray(self)[key]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, tuple) and np.isscalar(key[0]) and np.isscalar(key[1]):
+            self.__set((int(key[0]), int(key[1])), value)
+            return
+        if isinstance(key, tuple):
+            xs, ys = (np.asarray(k) for k in key)
+        else:
+            xs, ys = np.nonzero(np.asarray(key))
+        values = np.broadcast_to(np.asarray(value), xs.shape)
+        for x, y, v in zip(xs.tolist(), ys.tolist(), values.tolist()):
+            self.__set((x, y), v)
+
+    def __set(self, coord, value):
+        if value == self.__static[coord]:
+            self.__overlay.pop(coord, None)
+        else:
+            self.__overlay[coord] = self.dtype.type(value)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.array(self.__static, dtype=self.dtype if dtype is None else dtype)
+        for (x, y), value in self.__overlay.items():
+            dense[x, y] = value
+        return dense
+
+
+class OverlayGrid2D(Grid2D):
+    """
+    Grid2D whose global obstacles come from a shared StaticLayer. Only local obstacles, agents and
+    cells that are known to differ from the static layer are stored per grid, so copies are cheap.
+    Global obstacles must not be edited through this grid.
+    """
+
+    def __init__(self, static_layer):
+        self.__static_layer = static_layer
+        super().__init__(*static_layer.shape)
+
+    def new_cell_layer(self, w, h):
+        return OverlayLayer(self.__static_layer)
+
+    def cell(self, coord):
+        x, y = coord
+        agent_id = self.agents_at.get((x, y), None)
+        if agent_id is not None:
+            return agent_id
+        return self.cell_types.value(x, y)
+
+    def passable_cells(self):
+        """
+        See Grid2D.passable_cells. Open cells are shared with the static layer, so only the obstacles
+        of the overlay are collected.
+        """
+        h = self.height
+        blocked = {x * h + y for (x, y), cell in self.cell_types.overlay_items() if cell < 0}
+        return self.__static_layer.open_cells, blocked
+
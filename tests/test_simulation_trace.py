@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("systemd.journal")
+
+from grid2d import LOCAL_OBSTACLE
+from simulation_trace import read_trace, MOVES, PLAN_HEADS
+from simulator import Simulator
+
+AGENT_ID = 2  # Agent 1 is the human player.
+
+
+def run_traced(trace_file, steps):
+    """
+    Runs an agent along a corridor until it sees a local obstacle in the way, past a global obstacle
+    that turns the corridor into a dead end:
+        . . . . . .
+        . . . # . .
+        A . . . L G
+    The agent only sees L from (2,2), and then has to turn back.
+    """
+    sim = Simulator(6, 3, None, "trace", trace_file=str(trace_file))
+    sim.add_obstacle((3, 1))
+    sim.add_obstacle((4, 2), LOCAL_OBSTACLE)
+    sim.add_agent((0, 2), AGENT_ID)
+    sim.assign_goal(AGENT_ID, (5, 2))
+    t = 0
+    sim.update_agents(t)
+    for _ in range(steps):
+        sim.communicate()
+        sim.update_agents(t)
+        assert sim.simulate_step()
+        t += 1
+        sim.update_agents(t)
+    sim.close_trace()
+
+
+def test_plan_heads_are_traced_before_replanning(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "results").mkdir()
+    trace_file = tmp_path / "trace.bin"
+    run_traced(trace_file, 4)
+
+    moves = {}
+    plan_heads = {}
+    for kind, time_step, content in read_trace(str(trace_file)):
+        if kind == MOVES:
+            moves[time_step] = content[AGENT_ID]
+        elif kind == PLAN_HEADS:
+            assert time_step not in plan_heads  # Traced once per time step.
+            plan_heads[time_step] = content.get(AGENT_ID, None)
+
+    # Straight ahead while the corridor looks clear.
+    assert plan_heads[1] == ((2, 2), 2)
+    assert moves[1] == (2, 2)
+    # At (2,2) the obstacle comes into sight: the plan held still goes straight, the move turns back.
+    assert plan_heads[2] == ((3, 2), 3)
+    assert moves[2] == (2, 1)
@@ -0,0 +1,185 @@
+import copy
+import numpy as np
+
+from grid2d import Grid2D
+
+DEFAULT_KEYFRAME_INTERVAL = 32
+DEFAULT_MEMMAP_CAPACITY = 1024
+
+
+class DeltaTimeline:
+    def __init__(self, initial_grid, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+        """
+        Stores the history of a 2D grid as periodic keyframes plus per-step deltas.
+        Only the latest time step (the head) is kept fully materialised. Older steps
+        are rebuilt on demand from the nearest preceding keyframe.
+        :param initial_grid: Grid2D at time step 0. It remains editable until the first step is appended.
+        :param keyframe_interval: A full copy of the grid is kept every keyframe_interval steps.
+        """
+        if keyframe_interval < 1:
+            print("DeltaTimeline::__init__: Invalid keyframe interval. Using default.")
+            keyframe_interval = DEFAULT_KEYFRAME_INTERVAL
+        self.__keyframe_interval = keyframe_interval
+        self.__head = initial_grid
+        self.__keyframes = {}
+        # __deltas[t] holds the changes from t - 1 to t as ({coord: cell}, {agent_id: coord}).
+        self.__deltas = [None]
+        self.__cached_time_step = None
+        self.__cached_grid = None
+
+    def __len__(self):
+        return len(self.__deltas)
+
+    def latest_time_step(self):
+        return len(self.__deltas) - 1
+
+    def head(self):
+        """
+        :returns Grid2D instance of the latest time step. This is the only mutable step.
+        """
+        return self.__head
+
+    def raw_grid_at(self, t):
+        """
+        Returns the cells of time step t.
+        :param t: Time step.
+        :returns Numpy 2D array if found. False if not found.
+        """
+        grid = self.grid_at(t)
+        if grid is False:
+            return False
+        return grid.cells
+
+    def grid_at(self, t):
+        """
+        Returns 2D grid snapshot from time step t, rebuilding it from a keyframe if needed.
+        :param t: Time step.
+        :returns Grid2D instance if found. False if not found.
+        """
+        if t < 0 or t > self.latest_time_step():
+            print("DeltaTimeline::grid_at: Time step {0} out of bounds.".format(t))
+            return False
+        if t == self.latest_time_step():
+            return self.__head
+        if self.__cached_time_step == t:
+            return self.__cached_grid
+
+        keyframe_step = (t // self.__keyframe_interval) * self.__keyframe_interval
+        start_step, start_grid = keyframe_step, self.__keyframes[keyframe_step]
+        # Replaying from a previously rebuilt step is cheaper when scrubbing forwards.
+        if self.__cached_time_step is not None and keyframe_step < self.__cached_time_step < t:
+            start_step, start_grid = self.__cached_time_step, self.__cached_grid
+
+        grid = copy.deepcopy(start_grid)
+        for step in range(start_step + 1, t + 1):
+            cell_values, agent_positions = self.__deltas[step]
+            grid.apply_changes(cell_values, agent_positions)
+
+        self.__cached_time_step = t
+        self.__cached_grid = grid
+        return grid
+
+    def advance(self, moves):
+        """
+        Applies a round of agent moves to the head, producing the next time step.
+        Only the cells touched by the moves are recorded.
+        :type moves: dict {key=agent_id (int), value=coord (int, int tuple)}.
+        :param moves: Dict containing the destination of every agent.
+        """
+        latest_time_step = self.latest_time_step()
+        if latest_time_step % self.__keyframe_interval == 0 and latest_time_step not in self.__keyframes:
+            self.__keyframes[latest_time_step] = copy.deepcopy(self.__head)
+
+        touched = set(moves.values())
+        for agent_id in moves.keys():
+            touched.add(self.__head.agent_positions[agent_id])
+        for agent_id, coord in moves.items():
+            self.__head.move_agent(agent_id, coord)
+
+        cell_values = {coord: self.__head.cell(coord) for coord in touched}
+        self.__deltas.append((cell_values, dict(moves)))
+
+
+class MemmapTimeline:
+    def __init__(self, initial_grid, filename, capacity=DEFAULT_MEMMAP_CAPACITY):
+        """
+        Stores the history of a 2D grid in a preallocated memory-mapped file of shape
+        (capacity, width, height). Old steps are served as views of the file, so they are
+        only paged in when read. The file doubles in size whenever capacity is exceeded.
+        :param initial_grid: Grid2D at time step 0. It remains editable until the first step is appended.
+        :param filename: Path of the file backing the history. It is overwritten.
+        :param capacity: Number of time steps initially allocated in the file.
+        """
+        if capacity < 1:
+            print("MemmapTimeline::__init__: Invalid capacity. Using default.")
+            capacity = DEFAULT_MEMMAP_CAPACITY
+        self.__head = initial_grid
+        self.__filename = filename
+        self.__num_steps = 1
+        self.__steps = np.memmap(filename, dtype=initial_grid.cells.dtype, mode='w+',
+                                 shape=(capacity, initial_grid.width, initial_grid.height))
+
+    def __len__(self):
+        return self.__num_steps
+
+    def latest_time_step(self):
+        return self.__num_steps - 1
+
+    def head(self):
+        """
+        :returns Grid2D instance of the latest time step. This is the only mutable step.
+        """
+        return self.__head
+
+    def raw_grid_at(self, t):
+        """
+        Returns the cells of time step t without copying them.
+        :param t: Time step.
+        :returns Read-only numpy 2D array if found. False if not found.
+        """
+        if t < 0 or t > self.latest_time_step():
+            print("MemmapTimeline::raw_grid_at: Time step {0} out of bounds.".format(t))
+            return False
+        if t == self.latest_time_step():
+            return self.__head.cells
+        cells = self.__steps[t]
+        cells.flags.writeable = False
+        return cells
+
+    def grid_at(self, t):
+        """
+        Returns 2D grid snapshot from time step t, backed by the memory-mapped file.
+        :param t: Time step.
+        :returns Grid2D instance if found. False if not found.
+        """
+        if t == self.latest_time_step():
+            return self.__head
+        cells = self.raw_grid_at(t)
+        if cells is False:
+            return False
+        return Grid2D.from_cells(cells)
+
+    def advance(self, moves):
+        """
+        Applies a round of agent moves to the head and writes the resulting cells to disk.
+        :type moves: dict {key=agent_id (int), value=coord (int, int tuple)}.
+        :param moves: Dict containing the destination of every agent.
+        """
+        if self.__num_steps == 1:
+            # Time step 0 could still be edited until now.
+            self.__steps[0] = self.__head.cells
+        if self.__num_steps >= len(self.__steps):
+            self.__grow()
+        for agent_id, coord in moves.items():
+            self.__head.move_agent(agent_id, coord)
+        self.__steps[self.__num_steps] = self.__head.cells
+        self.__num_steps += 1
+
+    def flush(self):
+        self.__steps.flush()
+
+    def __grow(self):
+        capacity, width, height = self.__steps.shape
+        self.__steps.flush()
+        self.__steps = np.memmap(self.__filename, dtype=self.__steps.dtype, mode='r+',
+                                 shape=(2 * capacity, width, height))
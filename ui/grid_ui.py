@@ -123,10 +123,12 @@ class ToolTipUI(QGraphicsRectItem):
         y = self.origin_y * CELL_SIZE
 
 class PathUI(QGraphicsRectItem):
-    def __init__(self, agent_id, path, path_length, parent=None):
+    def __init__(self, agent_id, path, path_length, parent=None, reservations=None):
         super(PathUI, self).__init__()
         self.path = path
         self.lines = []
+        self.reserved_lines = []  # Lines into cells reserved by other agents at the same time step.
+        self.reservations = reservations
         if self.path is None or len(self.path) == 0:
             return
         self.origin_x = path[0][POS][0]
@@ -155,6 +157,9 @@ class PathUI(QGraphicsRectItem):
                 min_y = to_y
             line = QGraphicsLineItem(QLineF(from_x, from_y, to_x, to_y), self)
             self.lines.append(line)
+            if self.reservations is not None and \
+                    self.reservations.is_reserved(*self.path[i + 1], ignore_agent=self.agent_id):
+                self.reserved_lines.append(line)
         # Midpoint of destination cell.
         dest_x, dest_y = self.relative(self.path[-1][POS])
 
@@ -184,6 +189,8 @@ class PathUI(QGraphicsRectItem):
                 pen = QPen(green)  # Green
                 brush = QBrush(green)
             pen.setWidth(5)
+            if line in self.reserved_lines:
+                pen.setStyle(Qt.DashLine)
             line.setPen(pen)
             box.setBrush(brush)
 
@@ -203,9 +210,10 @@ class GridUI(QGraphicsView):
         self.agent_visibilities = {}
         self.agent_positions = {}
         self.agent_goals = {}
+        self.reservations = None
         self.ui_paths = {}
         self.ui_visibilities = {}
-        self.base_grid = np.zeros((x_cells, y_cells), dtype=np.int)
+        self.base_grid = np.zeros((x_cells, y_cells), dtype=np.int32)
         self.keep_paths_on = False
         self.current_selection = None
         self.human_goal = None
@@ -265,8 +273,18 @@ class GridUI(QGraphicsView):
         self.agent_plans = plans
 
     def update_agent_optimal_plans(self, optimal_plans):
+        """
+        :param optimal_plans: dict {key=agent_id, value=function returning the optimal plan of the agent}.
+        """
         self.agent_optimal_plans = optimal_plans
 
+    def update_reservations(self, reservations):
+        """
+        :param reservations: ReservationTable of the plans being drawn. Steps of a path reserved by other
+        agents are drawn dashed. None if the plans drawn are not the current ones.
+        """
+        self.reservations = reservations
+
     def update_agent_visibilities(self, visibilities):
         self.agent_visibilities = visibilities
 
@@ -285,10 +303,12 @@ class GridUI(QGraphicsView):
         if plan is None or len(plan) == 0:
             return
         if optimal:
-            plan = self.agent_optimal_plans.get(agent_id, None)
-            path = PathUI(agent_id, self.agent_optimal_plans[agent_id], self.path_length, self)
+            plan = self.agent_optimal_plans[agent_id]()
+            if plan is None:
+                return
+            path = PathUI(agent_id, plan, self.path_length, self, self.reservations)
         else:
-            path = PathUI(agent_id, self.agent_plans[agent_id], self.path_length, self)
+            path = PathUI(agent_id, self.agent_plans[agent_id], self.path_length, self, self.reservations)
         self.ui_paths[agent_id] = path
         self.grid_scene.addItem(path)
         origin_x, origin_y = self.agent_plans[agent_id][0][POS]
@@ -322,7 +342,11 @@ class GridUI(QGraphicsView):
             self.draw_path(agent_id)
 
     def load_agent_grid(self, agent_id):
-        self.draw_grid(self.agent_world_models[agent_id])
+        world_model = self.agent_world_models.get(agent_id, None)
+        if world_model is None:
+            # The agent's history no longer holds this step (see Agent.HISTORY_POLICY).
+            world_model = self.base_grid
+        self.draw_grid(world_model)
         self.draw_visibility(agent_id)
         self.show_goal(agent_id)
 
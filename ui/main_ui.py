@@ -3,6 +3,7 @@ from PySide2.QtWidgets import *
 from PySide2.QtCore import QObject, Signal, Slot
 from ui.new_grid_settings_ui import NewGridSettings
 from ui.simulator_ui import SimulatorUI
+from scenario import scenario_dimensions
 
 
 class Application():
@@ -20,8 +21,7 @@ class Application():
 
         @Slot(str)
         def load_existing_grid(filename, player_id, recording):
-            file = open(filename, "r")
-            dimensions = file.readline().split()
+            dimensions = scenario_dimensions(filename)
             if len(dimensions) == 2:
                 self.simulator = SimulatorUI(int(dimensions[0]), int(dimensions[1]), filename, player_id, recording)
                 self.simulator.setMinimumSize(600, 800)
@@ -93,7 +93,7 @@ class NewGridSettings(QDialog):
         self.file_load.setEnabled(was_load_grid)
 
     def open_file_dialog(self):
-        filename, filter = QFileDialog.getOpenFileName(self, caption="Select Grid File", filter="*.grd", options=QFileDialog.DontUseNativeDialog)
+        filename, filter = QFileDialog.getOpenFileName(self, caption="Select Grid File", filter="Grid files (*.grd *.npz)", options=QFileDialog.DontUseNativeDialog)
         self.file_line_edit.setText(filename)
 
     new_grid_requested = Signal(int, int)
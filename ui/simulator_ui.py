@@ -2,6 +2,7 @@ from PySide2.QtWidgets import *
 from PySide2.QtCore import *
 from PySide2.QtGui import *
 import time
+import functools
 from simulator import Simulator
 from interactive_argument import InteractiveArgument
 from ui.grid_ui import GridUI
@@ -248,7 +249,7 @@ class SimulatorUI(QMainWindow):
             self.step_slider.setValue(self.current_step() - 1)
 
     def save_grid(self):
-        filename, filter = QFileDialog.getSaveFileName(self, "Save Grid to File", filter="*.grd", options=QFileDialog.DontUseNativeDialog)
+        filename, filter = QFileDialog.getSaveFileName(self, "Save Grid to File", filter="Text grid (*.grd);;Binary scenario (*.npz)", options=QFileDialog.DontUseNativeDialog)
         if filename:
             self.simulator.save_grid(filename)
 
@@ -366,13 +367,16 @@ class SimulatorUI(QMainWindow):
             positions[agent.agent_id()] = agent.current_pos()
             world_models[agent.agent_id()] = agent.world_model_at(step)
             plans[agent.agent_id()] = agent.plan_at(step)
-            optimal_plans[agent.agent_id()] = agent.optimal_plan_at(step)
+            optimal_plans[agent.agent_id()] = functools.partial(agent.optimal_plan_at, step)  # Only drawn on demand.
             visibilities[agent.agent_id()] = agent.visibility_radius()
             goals[agent.agent_id()] = agent.goal()
         self.grid_view.update_agent_positions(positions)
         self.grid_view.update_agent_models(world_models)
         self.grid_view.update_agent_plans(plans)
         self.grid_view.update_agent_optimal_plans(optimal_plans)
+        # Reservations only hold the current plans.
+        latest = step == self.simulator.simulation_size() - 1
+        self.grid_view.update_reservations(self.simulator.reservations() if latest else None)
         self.grid_view.update_agent_visibilities(visibilities)
         self.grid_view.update_agent_goals(goals)
 
@@ -18,6 +18,9 @@ def in_visibility_range(range, pos, cell):
     x_cell, y_cell = cell
     return abs(x_pos - x_cell) <= range and abs(y_pos - y_cell) <= range
 
+def manhattan_distance(a, b):
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
 def straight_line_path(origin, destination):
     # Inclusive
 